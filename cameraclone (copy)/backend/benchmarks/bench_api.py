@@ -0,0 +1,434 @@
+"""
+API load test and scaling benchmark.
+
+Seeds a throwaway work directory with a synthetic SQLite database (cameras,
+alerts, rollups), snapshot images, gallery files and portable configs, then
+serves the FastAPI app with uvicorn in a separate process (this script with
+--serve-port) and drives each endpoint with concurrent HTTP clients from
+this one, so clients never compete with the server for the GIL. No cameras
+or YOLO weights are needed: engines are never started and the preview model
+is only loaded by the stream endpoints, which are not benchmarked.
+
+Per endpoint it reports p50/p95/p99/mean/max latency, throughput, error
+count, response size and the server process's RSS (before / peak), and
+writes everything to a JSON file that a later run can be compared against:
+
+    python benchmarks/bench_api.py --cameras 10 --alerts 1000000 --out base.json
+    python benchmarks/bench_api.py --workdir /tmp/bench --reuse --compare base.json --out new.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_ENDPOINTS = [
+    "/alerts",
+    "/alerts/summary",
+    "/stats",
+    "/deployments/active",
+    "/gallery",
+]
+
+# Placeholder image bytes (JPEG SOI/EOI markers); endpoints only list files, never decode them
+TINY_JPEG = b"\xff\xd8\xff\xd9"
+
+
+# =============================
+# SEEDING
+# =============================
+
+def seed(workdir, cameras, alerts, images, gallery, days, batch=50000):
+    """Create data/ and configs/ under `workdir` with synthetic content."""
+    data_dir = os.path.join(workdir, "data")
+    images_dir = os.path.join(data_dir, "camera_images")
+    gallery_dir = os.path.join(data_dir, "gallery")
+    logs_dir = os.path.join(data_dir, "logs")
+    for d in (images_dir, gallery_dir, logs_dir, os.path.join(workdir, "configs")):
+        os.makedirs(d, exist_ok=True)
+
+    # Schema comes from the app's own models
+    from database import Base, engine, SessionLocal
+    import models  # noqa: F401  (registers tables)
+    import rollups
+    Base.metadata.create_all(bind=engine)
+
+    t = time.time()
+    image_names = []
+    for i in range(images):
+        cam = i % cameras + 1
+        direction = "IN" if i % 2 else "OUT"
+        name = f"camera{cam}_{direction}_{i:08d}.jpg"
+        with open(os.path.join(images_dir, name), "wb") as f:
+            f.write(TINY_JPEG)
+        image_names.append(name)
+
+    for i in range(gallery):
+        ext = ".mp4" if i % 5 == 0 else ".jpg"
+        with open(os.path.join(gallery_dir, f"capture_{i:08d}{ext}"), "wb") as f:
+            f.write(TINY_JPEG)
+
+    db_path = engine.url.database
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executemany(
+            "INSERT INTO cameras (id, name, url, polygon, line) VALUES (?, ?, ?, ?, ?)",
+            [
+                (
+                    cam,
+                    f"bench_camera_{cam}",
+                    f"rtsp://bench.invalid/{cam}",
+                    json.dumps([{"x": 0.2, "y": 0.2}, {"x": 0.8, "y": 0.2}, {"x": 0.8, "y": 0.8}, {"x": 0.2, "y": 0.8}]),
+                    json.dumps({"x1": 0.5, "y1": 0.0, "x2": 0.5, "y2": 1.0}),
+                )
+                for cam in range(1, cameras + 1)
+            ],
+        )
+
+        rng = random.Random(42)
+        start = datetime.utcnow() - timedelta(days=days)
+        span = days * 86400
+        inserted = 0
+        while inserted < alerts:
+            n = min(batch, alerts - inserted)
+            rows = []
+            for _ in range(n):
+                direction = "IN" if rng.random() < 0.5 else "OUT"
+                ts = start + timedelta(seconds=rng.random() * span)
+                image = f"data/camera_images/{rng.choice(image_names)}" if image_names else None
+                rows.append((rng.randint(1, cameras), f"Person {direction}", image, ts.strftime("%Y-%m-%d %H:%M:%S")))
+            conn.executemany(
+                "INSERT INTO alerts (camera_id, message, image_path, timestamp) VALUES (?, ?, ?, ?)", rows
+            )
+            conn.commit()
+            inserted += n
+            print(f"  seeded {inserted}/{alerts} alerts", end="\r", flush=True)
+        print()
+    finally:
+        conn.close()
+
+    db = SessionLocal()
+    try:
+        rollups.rebuild_rollups(db)
+    finally:
+        db.close()
+
+    # Portable configs read by /deployments/active
+    for cam in range(1, cameras + 1):
+        with open(os.path.join(logs_dir, f"config_{cam}.json"), "w") as f:
+            json.dump({
+                "camera_id": cam,
+                "camera_name": f"bench_camera_{cam}",
+                "url": f"rtsp://bench.invalid/{cam}",
+                "resolution": {"width": 1920, "height": 1080},
+                "polygon": [[384, 216], [1536, 216], [1536, 864], [384, 864]],
+                "line": {"x1": 960, "y1": 0, "x2": 960, "y2": 1080},
+            }, f, indent=4)
+
+    print(f"Seeded {cameras} cameras, {alerts} alerts, {images} images, {gallery} gallery files in {time.time() - t:.1f}s")
+
+
+# =============================
+# SERVER
+# =============================
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve(port, cameras):
+    """Server process: uvicorn with main:app in the work directory."""
+    import uvicorn
+    import main
+    from models import CameraLease
+
+    # Every camera looks deployed (leased by a node), without starting an engine
+    db = main.SessionLocal()
+    try:
+        db.query(CameraLease).delete()
+        db.add_all(
+            CameraLease(camera_id=cam, node_id="bench", expires_at=time.time() + 86400)
+            for cam in range(1, cameras + 1)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+
+
+def start_server(workdir, cameras, timeout=120):
+    """Start the server process and wait until it answers. Returns (process, port)."""
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve-port", str(port),
+         "--cameras", str(cameras), "--workdir", workdir],
+        cwd=workdir,
+    )
+    deadline = time.time() + timeout
+    while True:
+        if proc.poll() is not None:
+            raise RuntimeError(f"API server exited with code {proc.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/cameras")
+            ok = conn.getresponse().status == 200
+            conn.close()
+            if ok:
+                return proc, port
+        except (OSError, http.client.HTTPException):
+            pass
+        if time.time() > deadline:
+            proc.kill()
+            raise RuntimeError("API server did not start")
+        time.sleep(0.2)
+
+
+def stop_server(proc):
+    # SIGTERM lets uvicorn run the app's shutdown (lease release)
+    proc.terminate()
+    try:
+        proc.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+# =============================
+# LOAD
+# =============================
+
+def rss_mb(pid):
+    """Resident memory of process `pid` in MB (/proc, or ps where there is none)."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        out = subprocess.check_output(["ps", "-o", "rss=", "-p", str(pid)])
+        return int(out.strip()) / 1024
+
+
+class _RssSampler(threading.Thread):
+    def __init__(self, pid, interval=0.05):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = rss_mb(pid)
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, rss_mb(self.pid))
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        self.peak = max(self.peak, rss_mb(self.pid))
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def _client(port, path, count, timeout):
+    latencies, errors, nbytes = [], 0, 0
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    for _ in range(count):
+        t = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            resp = conn.getresponse()
+            body = resp.read()
+            if resp.status != 200:
+                errors += 1
+            nbytes = len(body)
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+        latencies.append(time.perf_counter() - t)
+    conn.close()
+    return latencies, errors, nbytes
+
+
+def bench_endpoint(port, pid, path, requests, concurrency, warmup, timeout):
+    _client(port, path, warmup, timeout)
+
+    per_client = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+    per_client = [n for n in per_client if n]
+
+    rss_before = rss_mb(pid)
+    sampler = _RssSampler(pid)
+    sampler.start()
+    t = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(per_client)) as pool:
+        results = list(pool.map(lambda n: _client(port, path, n, timeout), per_client))
+    wall = time.perf_counter() - t
+    sampler.stop()
+
+    latencies = sorted(l for r in results for l in r[0])
+    ms = [l * 1000 for l in latencies]
+    return {
+        "requests": len(latencies),
+        "concurrency": len(per_client),
+        "errors": sum(r[1] for r in results),
+        "p50_ms": percentile(ms, 50),
+        "p95_ms": percentile(ms, 95),
+        "p99_ms": percentile(ms, 99),
+        "mean_ms": sum(ms) / len(ms) if ms else None,
+        "max_ms": ms[-1] if ms else None,
+        "throughput_rps": len(latencies) / wall if wall > 0 else None,
+        "response_bytes": max((r[2] for r in results), default=0),
+        "rss_before_mb": round(rss_before, 1),
+        "rss_peak_mb": round(sampler.peak, 1),
+        "rss_delta_mb": round(sampler.peak - rss_before, 1),
+    }
+
+
+# =============================
+# REPORTING
+# =============================
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _fmt(value, spec=".1f"):
+    return "-" if value is None else format(value, spec)
+
+
+def print_report(results, baseline=None):
+    metrics = ["p50_ms", "p95_ms", "p99_ms", "throughput_rps", "rss_peak_mb"]
+    header = f"{'endpoint':<22}" + "".join(f"{m:>16}" for m in metrics) + f"{'errors':>8}"
+    print(header)
+    print("-" * len(header))
+    base_endpoints = (baseline or {}).get("endpoints", {})
+    for path, r in results["endpoints"].items():
+        row = f"{path:<22}"
+        base = base_endpoints.get(path)
+        for m in metrics:
+            cell = _fmt(r.get(m))
+            if base and base.get(m) and r.get(m) is not None:
+                change = (r[m] - base[m]) / base[m] * 100
+                cell += f" ({change:+.0f}%)"
+            row += f"{cell:>16}"
+        row += f"{r['errors']:>8}"
+        print(row)
+    if baseline:
+        print(f"(changes vs {baseline.get('meta', {}).get('commit') or 'baseline'}; "
+              f"latency/RSS: lower is better, throughput: higher is better)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workdir", help="Directory for the synthetic data (default: a new temp dir)")
+    parser.add_argument("--reuse", action="store_true", help="Skip seeding if the workdir already has a database")
+    parser.add_argument("--cameras", type=int, default=10)
+    parser.add_argument("--alerts", type=int, default=100000)
+    parser.add_argument("--days", type=int, default=30, help="Spread alerts over this many days")
+    parser.add_argument("--images", type=int, default=2000, help="Synthetic snapshot images")
+    parser.add_argument("--gallery", type=int, default=500, help="Synthetic gallery files")
+    parser.add_argument("--endpoints", nargs="+", default=DEFAULT_ENDPOINTS)
+    parser.add_argument("--requests", type=int, default=100, help="Measured requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", help="Previous results file to compare against")
+    parser.add_argument("--serve-port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    out_path = os.path.abspath(args.out)
+    compare_path = os.path.abspath(args.compare) if args.compare else None
+
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="cam_bench_"))
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+    db_path = os.path.join(workdir, "data", "cameras.db")
+
+    # The app uses paths relative to its working directory and reads the DB URL at
+    # import; the server process inherits both
+    os.chdir(workdir)
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    sys.path.insert(0, BACKEND_DIR)
+
+    if args.serve_port:
+        serve(args.serve_port, args.cameras)
+        return
+
+    print(f"Work dir: {workdir}")
+    if args.reuse and os.path.exists(db_path):
+        print("Reusing existing synthetic data")
+    else:
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        seed(workdir, args.cameras, args.alerts, args.images, args.gallery, args.days)
+
+    proc, port = start_server(workdir, args.cameras)
+    try:
+        results = {
+            "meta": {
+                "commit": git_commit(),
+                "created": datetime.utcnow().isoformat() + "Z",
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "params": {
+                    "cameras": args.cameras,
+                    "alerts": args.alerts,
+                    "images": args.images,
+                    "gallery": args.gallery,
+                    "requests": args.requests,
+                    "concurrency": args.concurrency,
+                    "reused_data": bool(args.reuse),
+                },
+            },
+            "endpoints": {},
+        }
+        for path in args.endpoints:
+            print(f"Benchmarking {path} ...", flush=True)
+            results["endpoints"][path] = bench_endpoint(
+                port, proc.pid, path, args.requests, args.concurrency, args.warmup, args.timeout
+            )
+    finally:
+        stop_server(proc)
+
+    with open(out_path, "w") as f:
+        json.dump(results, f, indent=2)
+
+    baseline = None
+    if compare_path:
+        with open(compare_path) as f:
+            baseline = json.load(f)
+    print()
+    print_report(results, baseline)
+    print(f"\nResults written to {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Pre/post-event clip recording.
+
+Each rule engine keeps a ClipRecorder: a bounded ring of recent JPEG-encoded
+frames. When an alert fires, the frames from `pre_seconds` before it are
+copied into a pending clip that keeps collecting until `post_seconds` after
+the last alert; alerts that land inside a pending clip extend it instead of
+starting a new one. Finished clips go to a single background encoder thread,
+which writes the video and links it from every Alert row it covers.
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+from database import SessionLocal
+from models import Alert
+
+CLIPS_DIR = os.path.join("data", "clips")
+
+
+class _PendingClip:
+    __slots__ = ("start", "end", "frames", "nbytes", "alert_ids")
+
+    def __init__(self, start, end, frames):
+        self.start = start
+        self.end = end
+        self.frames = list(frames)
+        self.nbytes = sum(len(buf) for _, buf in self.frames)
+        self.alert_ids = []
+
+
+class ClipRecorder:
+    """
+    Frame ring and clip assembly for one camera. Not thread-safe: call it
+    from the rule engine loop only.
+
+    Memory is bounded by `max_bytes` for the ring plus `max_bytes` for the
+    clip being collected; clips are cut at `max_clip_seconds` or when they
+    reach `max_bytes`.
+    """
+
+    def __init__(self, camera_id, pre_seconds=5.0, post_seconds=5.0, max_clip_seconds=60.0,
+                 max_bytes=32 * 1024 * 1024, quality=70):
+        self.camera_id = camera_id
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.max_clip_seconds = max_clip_seconds
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self._ring = deque()
+        self._ring_bytes = 0
+        self._pending = None
+
+    def push(self, frame, ts=None):
+        """Add one frame to the ring (and to the pending clip, if any)."""
+        ts = time.time() if ts is None else ts
+        ok, buf = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), self.quality])
+        if not ok:
+            return
+        item = (ts, buf.tobytes())
+
+        ring = self._ring
+        ring.append(item)
+        self._ring_bytes += len(item[1])
+        while ring and (ts - ring[0][0] > self.pre_seconds or self._ring_bytes > self.max_bytes):
+            self._ring_bytes -= len(ring.popleft()[1])
+
+        pending = self._pending
+        if pending is not None:
+            if pending.nbytes + len(item[1]) > self.max_bytes:
+                print(f"Camera {self.camera_id}: clip reached {self.max_bytes} bytes, cutting it short")
+                self._finish()
+                return
+            pending.frames.append(item)
+            pending.nbytes += len(item[1])
+            if ts >= pending.end or ts - pending.start >= self.max_clip_seconds:
+                self._finish()
+
+    def trigger(self, alert_id, ts=None):
+        """Record a clip around an alert, merging with a clip still being collected."""
+        ts = time.time() if ts is None else ts
+        pending = self._pending
+        if pending is not None and ts - self.pre_seconds <= pending.end:
+            pending.end = max(pending.end, ts + self.post_seconds)
+        else:
+            start = ts - self.pre_seconds
+            pending = _PendingClip(start, ts + self.post_seconds, (f for f in self._ring if f[0] >= start))
+            self._pending = pending
+        if alert_id is not None:
+            pending.alert_ids.append(alert_id)
+
+    def close(self):
+        """Flush whatever has been collected so far (engine stopping)."""
+        if self._pending is not None:
+            self._finish()
+        self._ring.clear()
+        self._ring_bytes = 0
+
+    def _finish(self):
+        pending = self._pending
+        self._pending = None
+        if pending.frames:
+            submit_clip(self.camera_id, pending.frames, pending.alert_ids)
+
+
+# =============================
+# BACKGROUND ENCODER
+# =============================
+
+_clip_queue = queue.Queue(maxsize=8)
+_encoder_lock = threading.Lock()
+_encoder_thread = None
+
+
+def submit_clip(camera_id, frames, alert_ids):
+    """Hand a finished clip to the encoder without ever blocking the caller."""
+    global _encoder_thread
+    with _encoder_lock:
+        if _encoder_thread is None or not _encoder_thread.is_alive():
+            _encoder_thread = threading.Thread(target=_encoder_loop, daemon=True)
+            _encoder_thread.start()
+    try:
+        _clip_queue.put_nowait((camera_id, frames, alert_ids))
+    except queue.Full:
+        print(f"Camera {camera_id}: clip encoder busy, dropping clip for alerts {alert_ids}")
+
+
+def _open_writer(path, fps, size):
+    # H.264 plays in browsers; fall back to MPEG-4 Part 2 where it is unavailable
+    for codec in ("avc1", "mp4v"):
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, size)
+        if writer.isOpened():
+            return writer
+        writer.release()
+    return None
+
+
+def write_clip(camera_id, frames):
+    """Decode JPEG frames and write them to an .mp4. Returns the data-relative path or None."""
+    os.makedirs(CLIPS_DIR, exist_ok=True)
+    first = cv2.imdecode(np.frombuffer(frames[0][1], np.uint8), cv2.IMREAD_COLOR)
+    if first is None:
+        return None
+    height, width = first.shape[:2]
+
+    duration = frames[-1][0] - frames[0][0]
+    fps = (len(frames) - 1) / duration if duration > 0 else 10.0
+    fps = min(max(fps, 1.0), 60.0)
+
+    timestamp_str = time.strftime("%Y%m%d_%H%M%S", time.localtime(frames[0][0]))
+    filename = f"camera{camera_id}_{timestamp_str}_{int(frames[0][0] * 1000) % 1000:03d}.mp4"
+    path = os.path.join(CLIPS_DIR, filename)
+
+    writer = _open_writer(path, fps, (width, height))
+    if writer is None:
+        print(f"Camera {camera_id}: no usable video codec for clips")
+        return None
+    try:
+        for _, buf in frames:
+            frame = cv2.imdecode(np.frombuffer(buf, np.uint8), cv2.IMREAD_COLOR)
+            if frame is None:
+                continue
+            if frame.shape[:2] != (height, width):
+                frame = cv2.resize(frame, (width, height))
+            writer.write(frame)
+    finally:
+        writer.release()
+    return f"data/clips/{filename}"
+
+
+def _encoder_loop():
+    while True:
+        camera_id, frames, alert_ids = _clip_queue.get()
+        try:
+            clip_path = write_clip(camera_id, frames)
+            if clip_path and alert_ids:
+                db = SessionLocal()
+                try:
+                    db.query(Alert).filter(Alert.id.in_(alert_ids)).update(
+                        {Alert.clip_path: clip_path}, synchronize_session=False
+                    )
+                    db.commit()
+                finally:
+                    db.close()
+            if clip_path:
+                print(f"Camera {camera_id}: clip saved {clip_path} for alerts {alert_ids}")
+        except Exception as e:
+            print(f"Camera {camera_id}: clip encoding failed: {e}")
+        finally:
+            _clip_queue.task_done()
@@ -0,0 +1,182 @@
+"""
+Streaming bulk export of alerts.
+
+Rows are read with keyset pagination on `alerts.id` (WHERE id > last ORDER BY
+id LIMIT n), so memory stays constant however many rows match. Each export
+is pinned to the highest alert id present when it started; a client that
+loses the connection resumes with `after_id=<last id received>` and the same
+`until_id` and gets exactly the rows it is missing.
+
+Occupancy reporting should count on `direction` ("IN" / "OUT" for line
+crossings); `message` only carries the rule's label.
+"""
+
+import csv
+import io
+import zlib
+from datetime import datetime, timezone
+
+from sqlalchemy import String, func, select, type_coerce
+
+from database import SessionLocal
+from models import Alert
+
+COLUMNS = ["id", "camera_id", "message", "rule", "direction", "image_path", "clip_path", "timestamp"]
+
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def ms_to_db_time(ms):
+    """
+    Epoch milliseconds as a timestamp string comparable with stored alerts.
+
+    Alerts are stored as naive UTC text, with or without fractional seconds;
+    a whole-second bound is written without them so both forms compare right.
+    """
+    dt = datetime.fromtimestamp(ms / 1000.0, timezone.utc).replace(tzinfo=None)
+    if dt.microsecond:
+        return dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+    return dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def max_alert_id():
+    db = SessionLocal()
+    try:
+        return db.execute(select(func.max(Alert.id))).scalar() or 0
+    finally:
+        db.close()
+
+
+def iter_alert_chunks(start=None, end=None, camera_ids=None, after_id=0, until_id=None,
+                      chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield lists of row tuples (in COLUMNS order) in ascending id order."""
+    columns = [getattr(Alert, c) for c in COLUMNS]
+    last_id = after_id or 0
+    while True:
+        stmt = select(*columns).where(Alert.id > last_id)
+        if until_id is not None:
+            stmt = stmt.where(Alert.id <= until_id)
+        if start is not None:
+            stmt = stmt.where(type_coerce(Alert.timestamp, String) >= ms_to_db_time(start))
+        if end is not None:
+            stmt = stmt.where(type_coerce(Alert.timestamp, String) < ms_to_db_time(end))
+        if camera_ids:
+            stmt = stmt.where(Alert.camera_id.in_(camera_ids))
+        stmt = stmt.order_by(Alert.id).limit(chunk_size)
+
+        # Short-lived session per chunk: no long read transaction holds the DB
+        db = SessionLocal()
+        try:
+            rows = db.execute(stmt).all()
+        finally:
+            db.close()
+
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1][0]
+
+
+def _format_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def csv_stream(chunks, header=True):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if header:
+        writer.writerow(COLUMNS)
+    for rows in chunks:
+        for row in rows:
+            writer.writerow([_format_value(v) for v in row])
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate(0)
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+class _DrainSink:
+    """Write-only file object whose bytes are handed out as they are written."""
+
+    closed = False
+
+    def __init__(self):
+        self._parts = []
+        self._pos = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def parquet_stream(chunks, compression="snappy"):
+    """One Parquet row group per chunk, streamed as it is written."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("id", pa.int64()),
+        ("camera_id", pa.int64()),
+        ("message", pa.string()),
+        ("rule", pa.string()),
+        ("direction", pa.string()),
+        ("image_path", pa.string()),
+        ("clip_path", pa.string()),
+        ("timestamp", pa.timestamp("us", tz="UTC")),
+    ])
+
+    sink = _DrainSink()
+    writer = pq.ParquetWriter(sink, schema, compression=compression)
+    try:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            table = pa.Table.from_arrays(
+                [pa.array(col, type=field.type) for col, field in zip(columns, schema)],
+                schema=schema
+            )
+            writer.write_table(table)
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def gzip_stream(parts, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for part in parts:
+        data = compressor.compress(part)
+        if data:
+            yield data
+    yield compressor.flush()
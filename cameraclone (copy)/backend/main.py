@@ -36,27 +36,48 @@ from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 from pydantic import BaseModel
+from typing import List, Optional
 import cv2
 import json
 import os
+import re
 import threading
 import time
 import shutil
 import numpy as np
 from datetime import datetime
 from datetime import datetime
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends
-
-from database import SessionLocal, engine, Base
-from models import Camera, Alert
+from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Query
+
+from database import SessionLocal, engine, Base, upgrade_schema
+from models import Camera, Alert, AlertRollup, CameraLease
+import rollups
+import exports
+from streams import CaptureSupervisor, SnapshotSource
+from clips import ClipRecorder
+from trajectories import TrajectoryRecorder
+from sharding import LeaseManager
+import trajectories
+from rules import load_rules, build_rules, validate_rules, update_default_rule, check_geometry, normalize_rule, normalize_points, normalize_line, needs_resolution, rule_to_pixels
 
 # =============================
 # INITIAL SETUP
 # =============================
 
-model = YOLO("yolov8s.pt")
+# Shared detector for the preview stream, loaded on first use so the API
+# (and tooling such as benchmarks/bench_api.py) starts without the weights
+model = None
+model_lock = threading.Lock()
+
+def get_model():
+    global model
+    with model_lock:
+        if model is None:
+            model = YOLO("yolov8s.pt")
+        return model
 
 Base.metadata.create_all(bind=engine)
+upgrade_schema()
 
 app = FastAPI(root_path="/api")
 
@@ -81,16 +102,20 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Deployed configs live on the cameras table (shared by every node); files in
+# this directory from older versions are imported once at startup
 CONFIG_DIR = "configs"
 os.makedirs(CONFIG_DIR, exist_ok=True)
 
 active_captures = {}
 running_engines = {}
 stop_events = {}
+stopping_engines = {}  # { camera_id: thread } told to stop, not yet exited
+capture_supervisors = {}
+
+# Outages longer than this reset tracker state instead of resuming tracks
+MAX_TRACK_GAP = 10
 
-ALERT_COOLDOWN = 3
-last_alert_time = {}
-last_side = {}
 
 # =============================
 # Pydantic
@@ -99,6 +124,10 @@ last_side = {}
 class CameraCreate(BaseModel):
     name: str
     url: str
+    analysis_url: Optional[str] = None
+
+class AnalysisUrlData(BaseModel):
+    analysis_url: Optional[str] = None
 
 class PolygonData(BaseModel):
     points: list
@@ -109,10 +138,34 @@ class LineData(BaseModel):
     x2: float
     y2: float
 
+class RulesData(BaseModel):
+    rules: list
+
+class ReplayRequest(BaseModel):
+    start: int  # epoch milliseconds
+    end: int
+    config: Optional[dict] = None
+
 # =============================
 # Utility & DB Dependency
 # =============================
 
+# Per-camera engine settings that live only in the deployed config
+ENGINE_OPTIONS = ("clip", "record_trajectories")
+
+def engine_options(cam, overrides=None):
+    options = {}
+    if cam.config:
+        try:
+            current = json.loads(cam.config)
+            options = {k: current[k] for k in ENGINE_OPTIONS if k in current}
+        except Exception:
+            pass
+    for k in ENGINE_OPTIONS:
+        if overrides and k in overrides:
+            options[k] = overrides[k]
+    return options
+
 def get_db():
     db = SessionLocal()
     try:
@@ -120,107 +173,250 @@ def get_db():
     finally:
         db.close()
 
+def load_camera_config(camera_id):
+    # Deployed config from the shared database, or None
+    db = SessionLocal()
+    try:
+        cam = db.query(Camera).filter(Camera.id == camera_id).first()
+        return json.loads(cam.config) if cam and cam.config else None
+    finally:
+        db.close()
+
+def set_camera_config(cam, config):
+    # Caller commits; the new version makes the owning node restart the engine
+    cam.config = json.dumps(config)
+    cam.config_version = (cam.config_version or 0) + 1
+
 # =============================
 # RULE ENGINE
 # =============================
 
+def export_portable_config(camera_id, url, config, rule_specs, width, height):
+    # width / height are the analysis (detection) stream resolution
+    log_dir = "data/logs"
+    os.makedirs(log_dir, exist_ok=True)
+    log_path = os.path.join(log_dir, f"config_{camera_id}.json")
+
+    # Fetch name from DB
+    db = SessionLocal()
+    cam_db = db.query(Camera).filter(Camera.id == camera_id).first()
+    camera_name = cam_db.name if cam_db else f"camera_{camera_id}"
+    db.close()
+
+    config_portable = {
+        "camera_id": camera_id,
+        "camera_name": camera_name,
+        "url": url,
+        "resolution": {"width": width, "height": height},
+    }
+    if config.get("analysis_url"):
+        config_portable["analysis_url"] = config["analysis_url"]
+
+    # Legacy single polygon / line kept for older readers, only when it is what runs
+    polygon = config.get("polygon")
+    line = config.get("line")
+    if polygon and line and not config.get("rules"):
+        legacy = rule_to_pixels({"polygon": polygon, "line": line}, width, height)
+        config_portable["polygon"] = legacy["polygon"]
+        config_portable["line"] = legacy["line"]
+
+    config_portable["rules"] = [rule_to_pixels(r, width, height) for r in rule_specs]
+
+    with open(log_path, "w") as f:
+        json.dump(config_portable, f, indent=4)
+    print(f"DEBUG: Portable config exported for Camera {camera_id}")
+
+
+def save_alert(camera_id, rule_name, label, track_id, frame, bbox=None, direction=None):
+    # label is the rule's display label (validated filename-safe);
+    # direction ("IN" / "OUT" / None) is what the occupancy counts use
+    # --- SAVE & LOG ---
+    data_dir = "data"
+    images_dir = os.path.join(data_dir, "camera_images")
+    logs_dir = os.path.join(data_dir, "logs")
+
+    os.makedirs(images_dir, exist_ok=True)
+    os.makedirs(logs_dir, exist_ok=True)
+
+    timestamp_str = time.strftime("%Y%m%d_%H%M%S")
+    iso_timestamp = datetime.now().isoformat()
+
+    # Rule name, track and milliseconds keep simultaneous alerts from sharing a file
+    rule_part = re.sub(r"[^A-Za-z0-9_-]", "_", rule_name)[:32]
+    track_part = f"_{int(track_id)}" if track_id is not None else ""
+    millis = int(time.time() * 1000) % 1000
+    image_filename = f"camera{camera_id}_{rule_part}_{label}{track_part}_{timestamp_str}_{millis:03d}.jpg"
+    image_path = os.path.join(images_dir, image_filename)
+
+    try:
+        cv2.imwrite(image_path, frame)
+    except Exception as e:
+        print(f"Error saving image: {e}")
+
+    # Save JSON Log
+    json_filename = f"camera{camera_id}_log.json"
+    json_path = os.path.join(logs_dir, json_filename)
+
+    log_entry = {
+        "timestamp": iso_timestamp,
+        "camera_id": f"camera{camera_id}",
+        "event_type": label,
+        "direction": direction,
+        "rule": rule_name,
+        "count": 1,
+        "image": image_filename,
+        "track_id": int(track_id) if track_id is not None else None,
+        "status": "success"
+    }
+    if bbox is not None:
+        log_entry["bbox"] = bbox
+
+    current_logs = []
+    if os.path.exists(json_path):
+        try:
+            with open(json_path, 'r') as jf:
+                content = jf.read()
+                if content:
+                    current_logs = json.loads(content)
+        except:
+            current_logs = []
+
+    current_logs.append(log_entry)
+
+    with open(json_path, "w") as jf:
+        json.dump(current_logs, jf, indent=4)
+
+    # Database
+    db_image_path = f"data/camera_images/{image_filename}"
+    alert_id = None
+
+    try:
+        db = SessionLocal()
+        alert_time = datetime.utcnow()
+        alert = Alert(
+            camera_id=camera_id, 
+            message=f"Person {label}", 
+            image_path=db_image_path,
+            rule=rule_name,
+            direction=direction,
+            timestamp=alert_time
+        )
+        db.add(alert)
+        if direction:
+            rollups.record_alert(db, camera_id, direction, alert_time)
+        db.commit()
+        alert_id = alert.id
+    except Exception as e:
+        print(f"DB Error: {e}")
+    finally:
+        db.close()
+
+    if track_id is not None:
+        print(f"[ALERT] Camera {camera_id} [{rule_name}]: Person {track_id} went {label}")
+    else:
+        print(f"[ALERT] Camera {camera_id} [{rule_name}]: {label}")
+    return alert_id
+
+
 def rule_engine(camera_id, camera_url, stop_event):
     # Instantiate model PER THREAD for safe tracking persistence
     model = YOLO("yolov8s.pt")
     
-    config_path = os.path.join(CONFIG_DIR, f"camera_{camera_id}.json")
-
-    with open(config_path) as f:
-        config = json.load(f)
+    config = load_camera_config(camera_id)
+    if config is None:
+        print(f"Camera {camera_id}: not deployed")
+        return
 
-    polygon = config.get("polygon")
-    line = config.get("line")
     url = config["url"]
+    # Detection runs on the substream when one is configured
+    analysis_url = config.get("analysis_url") or url
+
+    try:
+        rule_specs = load_rules(config)
+    except ValueError as e:
+        print(f"Camera {camera_id}: Invalid rules: {e}")
+        return
 
-    if not polygon or not line:
-        print(f"Camera {camera_id}: Polygon or Line missing")
+    if not rule_specs:
+        print(f"Camera {camera_id}: No rules configured (polygon/line or rules missing)")
         return
 
-    print(f"DEBUG: Rule Engine Started for Camera {camera_id} - URL: {url}")
+    print(f"DEBUG: Rule Engine Started for Camera {camera_id} - URL: {analysis_url} - Rules: {[r['name'] for r in rule_specs]}")
+
+    # Reopens dropped or stalled streams with backoff; read() fails only once stopped
+    cap = CaptureSupervisor(analysis_url, name=f"Camera {camera_id}", stop_event=stop_event).start()
+    capture_supervisors[camera_id] = cap
 
-    cap = cv2.VideoCapture(url) # Let OpenCV auto-select backend
+    # Alert snapshots come from the main stream when analysing a substream
+    snapshots = None
+    if analysis_url != url:
+        snapshots = SnapshotSource(url, name=f"Camera {camera_id}").start()
     
-    # Local tracking state for this camera
-    # format: { track_id: side }
-    track_history = {}
+    # Every rule owns its tracking state (side, last seen, cooldown per track)
+    rules = build_rules(rule_specs)
     config_exported = False
-    
-    LINE_THRESHOLD = 10  # Normalized pixel distance threshold
+
+    # Optional ring of recent frames for pre/post-event clips
+    # ("clip": true or {"pre_seconds": .., "post_seconds": ..}); it JPEG-encodes
+    # every frame on this thread, so it is off unless configured
+    clip_cfg = config.get("clip")
+    clips = None
+    if clip_cfg is True or isinstance(clip_cfg, dict):
+        clip_cfg = clip_cfg if isinstance(clip_cfg, dict) else {}
+        clips = ClipRecorder(
+            camera_id,
+            pre_seconds=float(clip_cfg.get("pre_seconds", 5)),
+            post_seconds=float(clip_cfg.get("post_seconds", 5))
+        )
+
+    # Optional per-track trajectory log for offline rule replay
+    trajectory_log = None
+    if config.get("record_trajectories"):
+        trajectory_log = TrajectoryRecorder(camera_id)
+
+    def snapshot_for(frame, box):
+        # Main-stream frame for the alert, with the box mapped to its resolution
+        if snapshots is not None:
+            return snapshots.snapshot(frame, box, cap.get(cv2.CAP_PROP_POS_MSEC))
+        return frame, box
+
+    reconnects_seen = 0
 
     while not stop_event.is_set():
         success, frame = cap.read()
         if not success:
-            print(f"Camera {camera_id}: Stream failed/ended. Retrying in 5s...")
-            time.sleep(5)
-            continue
+            break
+
+        # Keep tracks across short drops; a long outage starts tracking afresh
+        if cap.reconnects != reconnects_seen:
+            reconnects_seen = cap.reconnects
+            if cap.last_gap > MAX_TRACK_GAP:
+                print(f"Camera {camera_id}: stream was down {cap.last_gap:.0f}s, resetting tracks")
+                for rule in rules:
+                    rule.clear()
+                trackers = getattr(getattr(model, "predictor", None), "trackers", None) or []
+                for tracker in trackers:
+                    tracker.reset()
+                if trajectory_log is not None:
+                    trajectory_log.new_session()
             
         height, width = frame.shape[:2]
         
         # EXPORT PORTABLE JSON ONCE PER SESSION
         if not config_exported:
             try:
-                log_dir = "data/logs"
-                os.makedirs(log_dir, exist_ok=True)
-                log_path = os.path.join(log_dir, f"config_{camera_id}.json")
-                
-                # Fetch name from DB
-                db = SessionLocal()
-                cam_db = db.query(Camera).filter(Camera.id == camera_id).first()
-                camera_name = cam_db.name if cam_db else f"camera_{camera_id}"
-                db.close()
-
-                config_portable = {
-                    "camera_id": camera_id,
-                    "camera_name": camera_name,
-                    "url": url,
-                    "resolution": {"width": width, "height": height},
-                    "polygon": [[int(p["x"] * width), int(p["y"] * height)] for p in polygon],
-                    "line": {
-                        "x1": int(line.get("x1", 0) * width),
-                        "y1": int(line.get("y1", 0) * height),
-                        "x2": int(line.get("x2", 0) * width),
-                        "y2": int(line.get("y2", 0) * height)
-                    }
-                }
-                with open(log_path, "w") as f:
-                    json.dump(config_portable, f, indent=4)
-                print(f"DEBUG: Portable config exported for Camera {camera_id}")
+                export_portable_config(camera_id, url, config, rule_specs, width, height)
                 config_exported = True
             except Exception as e:
                 print(f"Error exporting config for camera {camera_id}: {e}")
         
-        # Denormalize Polygon
-        # Refactor Poly to NumPy format [np.array([[x,y], ...])]
-        polygon_pts = np.array([[int(p["x"] * width), int(p["y"] * height)] for p in polygon], np.int32)
-        denorm_polygon = [polygon_pts]
-            
-        # Denormalize Line & ENFORCE Robust direction
-        lx1_raw = int(line["x1"] * width)
-        ly1_raw = int(line["y1"] * height)
-        lx2_raw = int(line["x2"] * width)
-        ly2_raw = int(line["y2"] * height)
-        
-        dx = lx2_raw - lx1_raw
-        dy = ly2_raw - ly1_raw
-        
-        # Sort based on dominant axis to determine a stable "forward" direction
-        if abs(dx) > abs(dy): # More horizontal
-            if lx1_raw > lx2_raw:
-                lx1, ly1, lx2, ly2 = lx2_raw, ly2_raw, lx1_raw, ly1_raw
-            else:
-                lx1, ly1, lx2, ly2 = lx1_raw, ly1_raw, lx2_raw, ly2_raw
-        else: # More vertical
-            if ly1_raw > ly2_raw:
-                lx1, ly1, lx2, ly2 = lx2_raw, ly2_raw, lx1_raw, ly1_raw
-            else:
-                lx1, ly1, lx2, ly2 = lx1_raw, ly1_raw, lx2_raw, ly2_raw
-        
-        line_len = np.sqrt((lx2 - lx1)**2 + (ly2 - ly1)**2) + 1e-6
+        # Denormalize geometry (only recomputed when the resolution changes)
+        now = time.time()
+        if clips is not None:
+            clips.push(frame, now)
+        for rule in rules:
+            rule.compile(width, height)
+            rule.begin_frame(now)
  
         # Run Tracking with improved parameters
         # iou=0.5 helps with overlapping boxes in groups
@@ -232,165 +428,196 @@ def rule_engine(camera_id, camera_url, stop_event):
 
             # Get boxes and IDs
             boxes = r.boxes.xyxy.cpu().numpy()
-            track_ids = r.boxes.id.int().cpu().numpy()
-            
-            # CLEANUP: Remove old tracks
-            active_ids = set(track_ids)
-            track_history = {
-                tid: side_val
-                for tid, side_val in track_history.items()
-                if tid in active_ids
-            }
+            track_ids = r.boxes.id.int().cpu().numpy().tolist()
+            for rule in rules:
+                rule.mark_seen(track_ids)
+            if trajectory_log is not None:
+                trajectory_log.add(now, track_ids, boxes, width, height)
 
             for box, track_id in zip(boxes, track_ids):
                 x1, y1, x2, y2 = map(int, box)
                 cx = (x1 + x2) // 2
                 cy = (y1 + y2) // 2
 
-                # Calculate side (cross product)
-                side_val = (lx2 - lx1) * (cy - ly1) - (ly2 - ly1) * (cx - lx1)
-                # Normalize by line length to get pixel distance
-                side = side_val / line_len
-                
-                # Check ROI (Polygon) using OpenCV pointPolygonTest
-                # format: cv2.pointPolygonTest(contour, pt, measureDist)
-                is_inside = cv2.pointPolygonTest(denorm_polygon[0], (float(cx), float(cy)), False)
-                if is_inside < 0:
-                    continue
-
-                # Initialize history if new
-                if track_id not in track_history:
-                    track_history[track_id] = side
-                    continue
-
-                previous_side = track_history[track_id]
-
-                # CROSSING LOGIC
-                if (
-                    abs(previous_side) > LINE_THRESHOLD and
-                    abs(side) > LINE_THRESHOLD and
-                    previous_side * side < 0
-                ):
-                    direction = "IN" if side > 0 else "OUT"
-                    
-                    # COOLDOWN PER TRACK
-                    now = time.time()
-                    key = (camera_id, int(track_id))
-
-                    if key not in last_alert_time or (now - last_alert_time[key] > ALERT_COOLDOWN):
-                        
-                        # --- SAVE & LOG ---
-                        data_dir = "data"
-                        images_dir = os.path.join(data_dir, "camera_images")
-                        logs_dir = os.path.join(data_dir, "logs")
-                        
-                        os.makedirs(images_dir, exist_ok=True)
-                        os.makedirs(logs_dir, exist_ok=True)
-                        
-                        timestamp_str = time.strftime("%Y%m%d_%H%M%S")
-                        iso_timestamp = datetime.now().isoformat()
-                        
-                        image_filename = f"camera{camera_id}_{direction}_{timestamp_str}.jpg"
-                        image_path = os.path.join(images_dir, image_filename)
-                        
-                        try:
-                            cv2.imwrite(image_path, frame)
-                        except Exception as e:
-                            print(f"Error saving image: {e}")
-                        
-                        # Save JSON Log
-                        json_filename = f"camera{camera_id}_log.json"
-                        json_path = os.path.join(logs_dir, json_filename)
-                        
-                        log_entry = {
-                            "timestamp": iso_timestamp,
-                            "camera_id": f"camera{camera_id}",
-                            "event_type": direction,
-                            "count": 1,
-                            "image": image_filename,
-                            "track_id": int(track_id),
-                            "status": "success"
-                        }
-                        
-                        current_logs = []
-                        if os.path.exists(json_path):
-                            try:
-                                with open(json_path, 'r') as jf:
-                                    content = jf.read()
-                                    if content:
-                                        current_logs = json.loads(content)
-                            except:
-                                current_logs = []
-                        
-                        current_logs.append(log_entry)
-                        
-                        with open(json_path, "w") as jf:
-                            json.dump(current_logs, jf, indent=4)
-
-                        # Database
-                        db_image_path = f"data/camera_images/{image_filename}"
-                        
-                        try:
-                            db = SessionLocal()
-                            alert = Alert(
-                                camera_id=camera_id, 
-                                message=f"Person {direction}", 
-                                image_path=db_image_path
-                            )
-                            db.add(alert)
-                            db.commit()
-                        except Exception as e:
-                            print(f"DB Error: {e}")
-                        finally:
-                            db.close()
-
-                        last_alert_time[key] = now
-                        print(f"[ALERT] Camera {camera_id}: Person {track_id} went {direction}")
-                
-                # Update history
-                track_history[track_id] = side
+                # All rules see the same detection in one pass
+                for rule in rules:
+                    label = rule.evaluate(track_id, cx, cy)
+                    if label:
+                        snapshot, bbox = snapshot_for(frame, [x1, y1, x2, y2])
+                        alert_id = save_alert(
+                            camera_id, rule.name, label, track_id, snapshot, bbox,
+                            direction=rule.direction_of(label)
+                        )
+                        if clips is not None:
+                            clips.trigger(alert_id, now)
+
+        for rule in rules:
+            label = rule.end_frame()
+            if label:
+                snapshot, _ = snapshot_for(frame, None)
+                alert_id = save_alert(camera_id, rule.name, label, None, snapshot, direction=rule.direction_of(label))
+                if clips is not None:
+                    clips.trigger(alert_id, now)
 
         time.sleep(0.01)
 
     cap.release()
+    if capture_supervisors.get(camera_id) is cap:
+        del capture_supervisors[camera_id]
+    if snapshots is not None:
+        snapshots.release()
+    if clips is not None:
+        clips.close()
+    if trajectory_log is not None:
+        trajectory_log.close()
+    for rule in rules:
+        rule.clear()
     print(f"DEBUG: Rule Engine Stopped for Camera {camera_id}")
 
+# =============================
+# ENGINE PLACEMENT
+# =============================
+
+def list_deployed_cameras():
+    # { camera_id: config version } for every deployed camera, from the shared DB
+    db = SessionLocal()
+    try:
+        rows = db.query(Camera.id, Camera.config_version).filter(Camera.config.isnot(None)).all()
+        return {camera_id: version or 0 for camera_id, version in rows}
+    finally:
+        db.close()
+
+def import_legacy_configs():
+    # Config files written by older versions become the camera's deployed config
+    db = SessionLocal()
+    try:
+        for filename in os.listdir(CONFIG_DIR):
+            if not (filename.startswith("camera_") and filename.endswith(".json")):
+                continue
+            path = os.path.join(CONFIG_DIR, filename)
+            try:
+                camera_id = int(filename[len("camera_"):-len(".json")])
+                with open(path) as f:
+                    config = json.load(f)
+            except (ValueError, OSError) as e:
+                print(f"DEBUG: Skipping {filename}: {e}")
+                continue
+            cam = db.query(Camera).filter(Camera.id == camera_id).first()
+            if cam is None:
+                print(f"DEBUG: Skipping {filename}: camera {camera_id} does not exist")
+                continue
+            if cam.config is not None:
+                print(f"DEBUG: Skipping {filename}: camera {camera_id} already has a deployed config")
+                continue
+            set_camera_config(cam, config)
+            db.commit()
+            # Never import a file twice (camera IDs can be reused after a delete)
+            os.replace(path, path + ".imported")
+            print(f"DEBUG: Imported deployed config for camera {camera_id}")
+    finally:
+        db.close()
+
+def start_engine(camera_id):
+    try:
+        camera_url = load_camera_config(camera_id)["url"]
+    except Exception as e:
+        print(f"Failed to start camera {camera_id}: {e}")
+        return
+
+    stop_event = threading.Event()
+    t = threading.Thread(target=rule_engine, args=(camera_id, camera_url, stop_event))
+    t.daemon = True
+    t.start()
+    running_engines[camera_id] = t
+    stop_events[camera_id] = stop_event
+    print(f"Started camera {camera_id}")
+
+def stop_engine(camera_id):
+    # Only signals the engine; the lease manager polls engine_alive until it has exited
+    stop_event = stop_events.pop(camera_id, None)
+    t = running_engines.pop(camera_id, None)
+    if stop_event:
+        stop_event.set()
+    if t:
+        stopping_engines[camera_id] = t
+
+def engine_alive(camera_id):
+    t = stopping_engines.get(camera_id) or running_engines.get(camera_id)
+    if t is not None and t.is_alive():
+        return True
+    stopping_engines.pop(camera_id, None)
+    return False
+
+def engine_status(camera_id):
+    supervisor = capture_supervisors.get(camera_id)
+    return supervisor.status() if supervisor is not None else None
+
+def active_leases(db, camera_ids=None):
+    # { camera_id: lease } for cameras some node currently holds (cluster-wide)
+    q = db.query(CameraLease).filter(CameraLease.expires_at >= time.time())
+    if camera_ids is not None:
+        q = q.filter(CameraLease.camera_id.in_(camera_ids))
+    return {lease.camera_id: lease for lease in q.all()}
+
+def lease_status(lease):
+    # Live status for engines on this node, else the owner's last report on the lease
+    status = engine_status(lease.camera_id) if lease.node_id == lease_manager.node_id else None
+    if status is None and lease.status:
+        status = json.loads(lease.status)
+    return status
+
+lease_manager = LeaseManager(list_deployed_cameras, start_engine, stop_engine, engine_alive, engine_status)
+
+@app.get("/cluster")
+def get_cluster_status():
+    return lease_manager.status()
+
 # =============================
 # AUTO STARTUP
 # =============================
 @app.on_event("startup")
 def startup_event():
     print(f"DEBUG: Startup event triggered. Config dir: {CONFIG_DIR}")
-    if not os.path.exists(CONFIG_DIR):
-        print("DEBUG: Config dir does not exist")
-        return
 
-    files = os.listdir(CONFIG_DIR)
-    print(f"DEBUG: Found config files: {files}")
+    # Drop expired trajectory files, including cameras no longer recording
+    try:
+        removed = trajectories.prune()
+        if removed:
+            print(f"DEBUG: Pruned {removed} old trajectory files")
+    except Exception as e:
+        print(f"Failed to prune trajectories: {e}")
 
-    for filename in files:
-        if filename.startswith("camera_") and filename.endswith(".json"):
-            try:
-                camera_id = int(filename.split("_")[1].split(".")[0])
-                config_path = os.path.join(CONFIG_DIR, filename)
-                with open(config_path) as f:
-                    cfg = json.load(f)
-                camera_url = cfg["url"]
-
-                stop_event = threading.Event()
-                t = threading.Thread(target=rule_engine, args=(camera_id, camera_url, stop_event))
-                t.daemon = True
-                t.start()
-                running_engines[camera_id] = t
-                stop_events[camera_id] = stop_event
-                print(f"Auto-started camera {camera_id}")
-            except Exception as e:
-                print(f"Failed to auto-start {filename}: {e}")
+    # Backfill directions and rollups for databases created before they existed
+    db = SessionLocal()
+    try:
+        rollups.backfill_directions(db)
+        if db.query(AlertRollup.id).first() is None and db.query(Alert.id).first() is not None:
+            rows = rollups.rebuild_rollups(db)
+            print(f"DEBUG: Rebuilt {rows} alert rollup rows")
+    except Exception as e:
+        print(f"Failed to rebuild alert rollups: {e}")
+    finally:
+        db.close()
+
+    try:
+        import_legacy_configs()
+    except Exception as e:
+        print(f"Failed to import config files: {e}")
+
+    # Engines start for the cameras this node holds leases for
+    # (fails startup if another live node uses the same NODE_ID)
+    lease_manager.start()
+    print(f"DEBUG: Lease manager started for node {lease_manager.node_id}")
     
     print("--------------------------------------------------")
     print(" >>> BACKEND VERSION 2.1 (LOGGING + STATS) LOADED <<< ")
     print("--------------------------------------------------")
 
+@app.on_event("shutdown")
+def shutdown_event():
+    # Release leases so other nodes pick up our cameras immediately
+    lease_manager.stop()
+
 # =============================
 # CRUD
 # =============================
@@ -398,7 +625,7 @@ def startup_event():
 @app.post("/cameras")
 def create_camera(camera: CameraCreate, db: Session = Depends(get_db)):
     try:
-        cam = Camera(name=camera.name, url=camera.url)
+        cam = Camera(name=camera.name, url=camera.url, analysis_url=camera.analysis_url or None)
         db.add(cam)
         db.commit()
         db.refresh(cam)
@@ -424,6 +651,15 @@ def save_polygon(camera_id: int, polygon: PolygonData, db: Session = Depends(get
     cam = db.query(Camera).filter(Camera.id == camera_id).first()
     if not cam:
         raise HTTPException(status_code=404, detail="Camera not found")
+    if cam.rules:
+        # Deploy evaluates the rules list, so the drawn shape goes to its "default" rule
+        try:
+            rules = update_default_rule(json.loads(cam.rules), polygon=polygon.points)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if rules is None:
+            raise HTTPException(status_code=409, detail="Camera has rules but no 'default' line rule; edit its rules instead")
+        cam.rules = json.dumps(rules)
     cam.polygon = json.dumps(polygon.points)
     db.commit()
     return {"message": "Polygon saved"}
@@ -433,50 +669,115 @@ def save_line(camera_id: int, line: LineData, db: Session = Depends(get_db)):
     cam = db.query(Camera).filter(Camera.id == camera_id).first()
     if not cam:
         raise HTTPException(status_code=404, detail="Camera not found")
+    if cam.rules:
+        # Deploy evaluates the rules list, so the drawn shape goes to its "default" rule
+        try:
+            rules = update_default_rule(json.loads(cam.rules), line=line.dict())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if rules is None:
+            raise HTTPException(status_code=409, detail="Camera has rules but no 'default' line rule; edit its rules instead")
+        cam.rules = json.dumps(rules)
     cam.line = json.dumps(line.dict())
     db.commit()
     return {"message": "Line saved"}
 
+@app.post("/camera/{camera_id}/analysis_url")
+def save_analysis_url(camera_id: int, data: AnalysisUrlData, db: Session = Depends(get_db)):
+    cam = db.query(Camera).filter(Camera.id == camera_id).first()
+    if not cam:
+        raise HTTPException(status_code=404, detail="Camera not found")
+    cam.analysis_url = data.analysis_url or None
+    db.commit()
+    return {"message": "Analysis stream saved"}
+
+@app.post("/camera/{camera_id}/rules")
+def save_rules(camera_id: int, data: RulesData, db: Session = Depends(get_db)):
+    cam = db.query(Camera).filter(Camera.id == camera_id).first()
+    if not cam:
+        raise HTTPException(status_code=404, detail="Camera not found")
+    try:
+        rules = validate_rules(data.rules)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    cam.rules = json.dumps(rules) if rules else None
+    db.commit()
+    return {"message": "Rules saved", "rules": rules}
+
 @app.post("/camera/{camera_id}/deploy")
 def deploy_camera(camera_id: int, db: Session = Depends(get_db)):
     cam = db.query(Camera).filter(Camera.id == camera_id).first()
     if not cam:
         raise HTTPException(status_code=404, detail="Camera not found")
 
-    if not cam.polygon or not cam.line:
-        raise HTTPException(status_code=400, detail="Please configure both polygon and line before deploying")
-
-    p_norm = json.loads(cam.polygon)
-    l_norm = json.loads(cam.line)
+    if not cam.rules and (not cam.polygon or not cam.line):
+        raise HTTPException(status_code=400, detail="Please configure both polygon and line (or rules) before deploying")
 
     # Save Internal Config
-    cfg_internal = {"url": cam.url, "polygon": p_norm, "line": l_norm}
-    path = os.path.join(CONFIG_DIR, f"camera_{camera_id}.json")
-    with open(path, "w") as f:
-        json.dump(cfg_internal, f)
-
-    # Manage thread
-    stop_event = stop_events.get(camera_id)
-    if stop_event:
-        stop_event.set()
-        time.sleep(0.5)
+    cfg_internal = {"url": cam.url}
+    if cam.analysis_url:
+        cfg_internal["analysis_url"] = cam.analysis_url
+    if cam.rules:
+        cfg_internal["rules"] = json.loads(cam.rules)
+    else:
+        cfg_internal["polygon"] = json.loads(cam.polygon)
+        cfg_internal["line"] = json.loads(cam.line)
+    cfg_internal.update(engine_options(cam))
+    set_camera_config(cam, cfg_internal)
+    db.commit()
 
-    new_stop_event = threading.Event()
-    stop_events[camera_id] = new_stop_event
-    t = threading.Thread(target=rule_engine, args=(camera_id, cam.url, new_stop_event))
-    t.daemon = True
-    t.start()
-    running_engines[camera_id] = t
+    # The owning node (re)starts the engine when it sees the new config
+    lease_manager.wake()
 
     return {"message": "Deployment triggered. Tracking is starting in the background."}
 
+@app.get("/camera/{camera_id}/connection")
+def get_connection_status(camera_id: int, db: Session = Depends(get_db)):
+    lease = active_leases(db, [camera_id]).get(camera_id)
+    if lease is None:
+        raise HTTPException(status_code=404, detail="Camera is not running on any node")
+    status = lease_status(lease)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Camera has not reported a connection yet (node {lease.node_id})")
+    return dict(status, node=lease.node_id)
+
 @app.get("/camera/{camera_id}/active-config")
 def get_active_config(camera_id: int):
-    path = os.path.join(CONFIG_DIR, f"camera_{camera_id}.json")
-    if not os.path.exists(path):
+    config = load_camera_config(camera_id)
+    if config is None:
         raise HTTPException(status_code=404, detail="No active configuration found for this camera")
-    with open(path, "r") as f:
-        return json.load(f)
+    return config
+
+@app.post("/camera/{camera_id}/replay")
+def replay_rules(camera_id: int, request: ReplayRequest):
+    # Re-evaluate a candidate config (default: the active one) on recorded trajectories
+    config = request.config
+    if config is None:
+        config = load_camera_config(camera_id)
+        if config is None:
+            raise HTTPException(status_code=404, detail="No active configuration found for this camera")
+
+    try:
+        check_geometry(config)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if needs_resolution(config):
+        resolution = config.get("resolution") or {}
+        width, height = resolution.get("width"), resolution.get("height")
+        if not width or not height:
+            raise HTTPException(status_code=400, detail="Absolute pixel coordinates need a 'resolution' to replay")
+        config = dict(config)
+        if config.get("polygon"):
+            config["polygon"] = normalize_points(config["polygon"], width, height)
+        if config.get("line"):
+            config["line"] = normalize_line(config["line"], width, height)
+        config["rules"] = [normalize_rule(r, width, height) for r in config.get("rules") or []]
+
+    try:
+        return trajectories.replay(camera_id, config, request.start / 1000.0, request.end / 1000.0)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.post("/camera/{camera_id}/upload_config")
 def upload_config(camera_id: int, config: dict, db: Session = Depends(get_db)):
@@ -484,70 +785,61 @@ def upload_config(camera_id: int, config: dict, db: Session = Depends(get_db)):
     if not cam:
         raise HTTPException(status_code=404, detail="Camera not found")
 
-    # Get dimensions for normalization (if needed)
-    cap = cv2.VideoCapture(cam.url)
-    success, frame = cap.read()
-    if not success:
-        cap.release()
-        raise HTTPException(status_code=500, detail="Could not access camera to detect resolution for normalization")
-    
-    height, width = frame.shape[:2]
-    cap.release()
+    try:
+        check_geometry(config)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     new_polygon = config.get("polygon", [])
     new_line = config.get("line", {})
+    new_rules = config.get("rules") or []
 
-    # Detect and Normalize if absolute
-    def normalize_pts(pts, w, h):
-        norm = []
-        for p in pts:
-            # Handle both list [x,y] and dict {"x":x, "y":y}
-            if isinstance(p, list) and len(p) == 2:
-                px, py = p[0], p[1]
-            elif isinstance(p, dict):
-                px, py = p.get("x", 0), p.get("y", 0)
-            else:
-                continue
-            
-            # Normalize if they look like absolute pixels
-            nx = px / w if px > 1.0 else px
-            ny = py / h if py > 1.0 else py
-            norm.append({"x": nx, "y": ny})
-        return norm
-
-    def normalize_line(l, w, h):
-        res = {}
-        for k in ["x1", "y1", "x2", "y2"]:
-            val = l.get(k, 0)
-            res[k] = val / (w if "x" in k else h) if val > 1.0 else val
-        return res
-
-    p_norm = normalize_pts(new_polygon, width, height)
-    l_norm = normalize_line(new_line, width, height)
-
-    # Update DB
-    cam.polygon = json.dumps(p_norm)
-    cam.line = json.dumps(l_norm)
-    db.commit()
+    if not new_rules and (not new_polygon or not new_line):
+        raise HTTPException(status_code=400, detail="Config needs polygon and line, or a rules list")
 
-    # Save Internal Config
-    cfg_internal = {"url": cam.url, "polygon": p_norm, "line": l_norm}
-    path = os.path.join(CONFIG_DIR, f"camera_{camera_id}.json")
-    with open(path, "w") as f:
-        json.dump(cfg_internal, f)
+    # Get dimensions for normalization (if needed)
+    width, height = 1, 1
+    if needs_resolution(config):
+        # Prefer the resolution recorded in a portable export
+        resolution = config.get("resolution") or {}
+        width, height = resolution.get("width"), resolution.get("height")
+        if not width or not height:
+            cap = cv2.VideoCapture(cam.url)
+            success, frame = cap.read()
+            if not success:
+                cap.release()
+                raise HTTPException(status_code=500, detail="Could not access camera to detect resolution for normalization")
+            
+            height, width = frame.shape[:2]
+            cap.release()
 
-    # Stop old thread and start new
-    stop_event = stop_events.get(camera_id)
-    if stop_event:
-        stop_event.set()
-        time.sleep(0.5)
+    # Detect and Normalize if absolute
+    try:
+        r_norm = validate_rules([normalize_rule(r, width, height) for r in new_rules])
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    cfg_internal = {"url": cam.url}
+    if cam.analysis_url:
+        cfg_internal["analysis_url"] = cam.analysis_url
+    if new_polygon and new_line:
+        p_norm = normalize_points(new_polygon, width, height)
+        l_norm = normalize_line(new_line, width, height)
+        cam.polygon = json.dumps(p_norm)
+        cam.line = json.dumps(l_norm)
+        cfg_internal["polygon"] = p_norm
+        cfg_internal["line"] = l_norm
+    if r_norm:
+        cfg_internal["rules"] = r_norm
+    cfg_internal.update(engine_options(cam, config))
+
+    # Update DB (a legacy polygon/line upload replaces any rules list)
+    cam.rules = json.dumps(r_norm) if r_norm else None
+    set_camera_config(cam, cfg_internal)
+    db.commit()
 
-    new_stop_event = threading.Event()
-    stop_events[camera_id] = new_stop_event
-    t = threading.Thread(target=rule_engine, args=(camera_id, cam.url, new_stop_event))
-    t.daemon = True
-    t.start()
-    running_engines[camera_id] = t
+    # The owning node restarts the engine when it sees the new config
+    lease_manager.wake()
 
     return {"message": "Configuration uploaded and engine restarted successfully!"}
 
@@ -579,15 +871,13 @@ def delete_camera(camera_id: int, db: Session = Depends(get_db)):
     if not cam:
         raise HTTPException(status_code=404, detail="Camera not found")
 
-    if camera_id in stop_events:
-        stop_events[camera_id].set()
-        del stop_events[camera_id]
-        if camera_id in running_engines:
-            del running_engines[camera_id]
-
     db.delete(cam)
+    rollups.delete_camera_rollups(db, camera_id)
     db.commit()
 
+    # With the row gone no node runs (or leases) this camera any more
+    lease_manager.wake()
+
     return {"message": "Camera deleted"}
 
 @app.get("/alerts")
@@ -598,13 +888,62 @@ def get_alerts(db: Session = Depends(get_db)):
             "id": a.id,
             "camera_id": a.camera_id,
             "message": a.message,
+            "rule": a.rule,
             "image": a.image_path if (a.image_path and a.image_path.startswith("data/")) else None,
+            "clip": a.clip_path,
             "timestamp": a.timestamp.isoformat() if a.timestamp else None
         }
         for a in alerts
     ]
     return result
 
+@app.get("/alerts/export")
+def export_alerts(
+    format: str = "csv",
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    camera_id: Optional[List[int]] = Query(None),
+    gzip: bool = False,
+    after_id: int = 0,
+    until_id: Optional[int] = None,
+    chunk_size: int = exports.DEFAULT_CHUNK_SIZE
+):
+    # start / end are epoch milliseconds; resume with after_id + the X-Export-Until-Id header
+    if format not in ("csv", "parquet"):
+        raise HTTPException(status_code=400, detail="format must be 'csv' or 'parquet'")
+    if format == "parquet" and not exports.parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export requires pyarrow")
+    if chunk_size < 1 or chunk_size > 100000:
+        raise HTTPException(status_code=400, detail="chunk_size must be between 1 and 100000")
+
+    if until_id is None:
+        until_id = exports.max_alert_id()
+
+    chunks = exports.iter_alert_chunks(
+        start=start, end=end, camera_ids=camera_id,
+        after_id=after_id, until_id=until_id, chunk_size=chunk_size
+    )
+    headers = {"X-Export-Until-Id": str(until_id)}
+    filename = f"alerts_{after_id}_{until_id}"
+
+    if format == "parquet":
+        # Parquet compresses internally; gzip picks its codec instead of wrapping the file
+        body = exports.parquet_stream(chunks, compression="gzip" if gzip else "snappy")
+        media_type = "application/vnd.apache.parquet"
+        filename += ".parquet"
+    else:
+        # Only the first request of a resumed export carries the header row
+        body = exports.csv_stream(chunks, header=not after_id)
+        media_type = "text/csv"
+        filename += ".csv"
+        if gzip:
+            body = exports.gzip_stream(body)
+            media_type = "application/gzip"
+            filename += ".gz"
+
+    headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
 @app.get("/alerts/summary")
 def get_alerts_summary(db: Session = Depends(get_db)):
     cameras = db.query(Camera).all()
@@ -614,15 +953,17 @@ def get_alerts_summary(db: Session = Depends(get_db)):
         # Optimized grouping/counting
         alerts = db.query(Alert).filter(Alert.camera_id == cam.id).order_by(Alert.timestamp.desc()).all()
         
-        in_count = sum(1 for a in alerts if "IN" in a.message.upper())
-        out_count = sum(1 for a in alerts if "OUT" in a.message.upper())
+        in_count = sum(1 for a in alerts if a.direction == "IN")
+        out_count = sum(1 for a in alerts if a.direction == "OUT")
         
         recent_list = [
             {
                 "id": a.id,
                 "timestamp": a.timestamp.isoformat(),
                 "image": a.image_path if (a.image_path and a.image_path.startswith("data/")) else None,
-                "message": a.message
+                "message": a.message,
+                "rule": a.rule,
+                "clip": a.clip_path
             }
             for a in alerts[:12] # Limit to last 12 for the card view
         ]
@@ -639,13 +980,13 @@ def get_alerts_summary(db: Session = Depends(get_db)):
 
 @app.get("/deployments/active")
 def get_active_deployments(db: Session = Depends(get_db)):
-    # running_engines stores { camera_id: thread_object }
-    active_ids = list(running_engines.keys())
+    # Cameras running on any node: every engine holds a lease in the shared DB
+    leases = active_leases(db)
     
-    if not active_ids:
+    if not leases:
         return []
 
-    cameras = db.query(Camera).filter(Camera.id.in_(active_ids)).all()
+    cameras = db.query(Camera).filter(Camera.id.in_(list(leases))).all()
     
     results = []
     for cam in cameras:
@@ -664,6 +1005,8 @@ def get_active_deployments(db: Session = Depends(get_db)):
             "camera_name": cam.name,
             "url": cam.url,
             "status": "Running",
+            "node": leases[cam.id].node_id,
+            "connection": lease_status(leases[cam.id]),
             "config": config_data
         })
         
@@ -673,14 +1016,34 @@ def get_active_deployments(db: Session = Depends(get_db)):
 @app.delete("/alerts")
 def clear_alerts(db: Session = Depends(get_db)):
     db.query(Alert).delete()
+    rollups.clear_rollups(db)
     db.commit()
     return {"message": "All alerts cleared"}
 
+@app.get("/analytics/occupancy")
+def get_occupancy_series(
+    start: int,
+    end: int,
+    bucket_ms: int = 3600000,
+    camera_id: Optional[List[int]] = Query(None),
+    db: Session = Depends(get_db)
+):
+    # start / end are epoch milliseconds (end exclusive)
+    try:
+        return rollups.occupancy_series(db, start, end, bucket_ms, camera_ids=camera_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/analytics/rollups/rebuild")
+def rebuild_alert_rollups(camera_id: Optional[int] = None, db: Session = Depends(get_db)):
+    rows = rollups.rebuild_rollups(db, camera_id=camera_id)
+    return {"message": "Rollups rebuilt", "rows": rows}
+
 @app.get("/stats")
 @app.get("/stats")
 def get_stats(db: Session = Depends(get_db)):
     # Logic to count IN vs OUT
-    # We can do this by querying alerts and filtering by message content
+    # Each alert stores its direction (None for zone / dwell alerts)
     alerts = db.query(Alert).all()
     
     stats = {}
@@ -690,9 +1053,9 @@ def get_stats(db: Session = Depends(get_db)):
         if cam_id not in stats:
             stats[cam_id] = {"in": 0, "out": 0}
             
-        if "IN" in a.message:
+        if a.direction == "IN":
             stats[cam_id]["in"] += 1
-        elif "OUT" in a.message:
+        elif a.direction == "OUT":
             stats[cam_id]["out"] += 1
             
     return stats
@@ -824,7 +1187,7 @@ def generate_yolo_frames(camera_id: int):
         if frame_count % 3 == 0 or results is None:
             # Resize for FASTER inference (Standard YOLOv8 training resolution is 640)
             inference_frame = cv2.resize(frame, (640, 480))
-            results = model.predict(inference_frame, conf=0.3, verbose=False)
+            results = get_model().predict(inference_frame, conf=0.3, verbose=False)
         
         # Plot boxes/labels on frame
         # Since we resized for inference, we need to ensure labels align with original frame
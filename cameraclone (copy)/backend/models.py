@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float, ForeignKey, UniqueConstraint
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from database import Base
@@ -10,8 +10,13 @@ class Camera(Base):
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, nullable=False)
     url = Column(String, nullable=False)
+    analysis_url = Column(String, nullable=True)  # optional low-res substream for detection
     polygon = Column(Text, nullable=True)
     line = Column(Text, nullable=True)
+    rules = Column(Text, nullable=True)
+    # Deployed engine config (JSON), shared by every node; bumped on each deploy
+    config = Column(Text, nullable=True)
+    config_version = Column(Integer, nullable=True, default=0)
 
     alerts = relationship("Alert", back_populates="camera", cascade="all, delete")
 
@@ -23,6 +28,40 @@ class Alert(Base):
     camera_id = Column(Integer, ForeignKey("cameras.id"), nullable=False)
     message = Column(String, nullable=False)
     image_path = Column(String, nullable=True)
+    clip_path = Column(String, nullable=True)
+    rule = Column(String, nullable=True)
+    direction = Column(String, nullable=True)  # "IN" / "OUT" for line crossings, else None
     timestamp = Column(DateTime(timezone=True), server_default=func.now())
 
     camera = relationship("Camera", back_populates="alerts")
+
+
+class AlertRollup(Base):
+    __tablename__ = "alert_rollups"
+    __table_args__ = (
+        UniqueConstraint("camera_id", "granularity", "bucket_start", "direction", name="uq_alert_rollup_bucket"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    camera_id = Column(Integer, nullable=False)
+    granularity = Column(String, nullable=False)  # "minute" | "hour" | "day"
+    bucket_start = Column(Integer, nullable=False)  # UTC epoch seconds
+    direction = Column(String, nullable=False)  # "IN" | "OUT"
+    count = Column(Integer, nullable=False, default=0)
+
+
+class ClusterNode(Base):
+    __tablename__ = "cluster_nodes"
+
+    id = Column(String, primary_key=True)
+    heartbeat = Column(Float, nullable=False)  # epoch seconds
+    instance = Column(String, nullable=True)  # random per process, guards against duplicate IDs
+
+
+class CameraLease(Base):
+    __tablename__ = "camera_leases"
+
+    camera_id = Column(Integer, primary_key=True, autoincrement=False)
+    node_id = Column(String, nullable=False)
+    expires_at = Column(Float, nullable=False)  # epoch seconds
+    status = Column(Text, nullable=True)  # owner's latest engine status (JSON), for cluster-wide views
@@ -0,0 +1,266 @@
+"""
+Incremental IN/OUT rollups for occupancy analytics.
+
+Every alert bumps one counter per granularity (minute, hour, day) in the
+`alert_rollups` table, so time-series queries read a handful of pre-aggregated
+rows instead of every raw alert. Buckets are aligned to UTC epoch seconds.
+
+Counts use the alert's stored `direction` ("IN" / "OUT", set by line rules),
+never its display label, so incremental updates and rebuilds agree.
+
+Rebuild from the raw `alerts` table after imports or bulk deletes:
+
+    python rollups.py rebuild
+"""
+
+import argparse
+from datetime import datetime, timezone
+
+from sqlalchemy import text
+from sqlalchemy.dialects.sqlite import insert
+
+from database import SessionLocal, engine, Base
+from models import AlertRollup
+
+GRANULARITIES = {
+    "minute": 60,
+    "hour": 3600,
+    "day": 86400,
+}
+
+DIRECTIONS = ("IN", "OUT")
+
+# Upper bound on buckets returned by a single series query
+MAX_BUCKETS = 10000
+
+
+def _epoch(ts):
+    if ts is None:
+        ts = datetime.now(timezone.utc)
+    if isinstance(ts, datetime):
+        if ts.tzinfo is None:
+            # Alert timestamps are stored as naive UTC (SQLite CURRENT_TIMESTAMP)
+            ts = ts.replace(tzinfo=timezone.utc)
+        return int(ts.timestamp())
+    return int(ts)
+
+
+def record_alert(db, camera_id, direction, ts=None):
+    """
+    Add one alert to the rollups inside the caller's transaction.
+
+    `ts` is the alert time (naive UTC datetime, aware datetime or epoch seconds).
+    The caller commits.
+    """
+    if direction not in DIRECTIONS:
+        return
+
+    epoch = _epoch(ts)
+    for name, seconds in GRANULARITIES.items():
+        stmt = insert(AlertRollup).values(
+            camera_id=camera_id,
+            granularity=name,
+            bucket_start=epoch - epoch % seconds,
+            direction=direction,
+            count=1,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["camera_id", "granularity", "bucket_start", "direction"],
+            set_={"count": AlertRollup.count + 1},
+        )
+        db.execute(stmt)
+
+
+def backfill_directions(db):
+    """
+    Set `direction` on alerts saved before it existed. Those predate rules
+    (`rule` is NULL) and their message is "Person IN" / "Person OUT".
+    """
+    result = db.execute(text("""
+        UPDATE alerts SET direction = CASE message
+            WHEN 'Person IN' THEN 'IN'
+            WHEN 'Person OUT' THEN 'OUT'
+        END
+        WHERE direction IS NULL AND rule IS NULL AND message IN ('Person IN', 'Person OUT')
+    """))
+    db.commit()
+    return result.rowcount
+
+
+def rebuild_rollups(db, camera_id=None):
+    """Regenerate rollups from the `alerts` table. Returns the number of rows written."""
+    backfill_directions(db)
+
+    delete_q = db.query(AlertRollup)
+    if camera_id is not None:
+        delete_q = delete_q.filter(AlertRollup.camera_id == camera_id)
+    delete_q.delete(synchronize_session=False)
+
+    camera_filter = "AND camera_id = :camera_id" if camera_id is not None else ""
+    written = 0
+    for name, seconds in GRANULARITIES.items():
+        result = db.execute(
+            text(f"""
+                INSERT INTO alert_rollups (camera_id, granularity, bucket_start, direction, count)
+                SELECT camera_id, :granularity, bucket_start, direction, COUNT(*)
+                FROM (
+                    SELECT
+                        camera_id,
+                        (CAST(strftime('%s', timestamp) AS INTEGER) / :seconds) * :seconds AS bucket_start,
+                        direction
+                    FROM alerts
+                    WHERE timestamp IS NOT NULL AND direction IN ('IN', 'OUT') {camera_filter}
+                )
+                GROUP BY camera_id, bucket_start, direction
+            """),
+            {"granularity": name, "seconds": seconds, "camera_id": camera_id},
+        )
+        written += result.rowcount
+    db.commit()
+    return written
+
+
+def delete_camera_rollups(db, camera_id):
+    db.query(AlertRollup).filter(AlertRollup.camera_id == camera_id).delete(synchronize_session=False)
+
+
+def clear_rollups(db):
+    db.query(AlertRollup).delete(synchronize_session=False)
+
+
+def pick_granularity(bucket_ms):
+    """Coarsest stored granularity that evenly divides the requested bucket size."""
+    for name in ("day", "hour", "minute"):
+        if bucket_ms % (GRANULARITIES[name] * 1000) == 0:
+            return name
+    return None
+
+
+def _sum_before(db, camera_ids, before):
+    """Net IN - OUT per camera for everything strictly before epoch second `before`."""
+    day = GRANULARITIES["day"]
+    day_floor = before - before % day
+    params = {"day_floor": day_floor, "before": before}
+    camera_filter = ""
+    if camera_ids:
+        camera_filter = "AND camera_id IN (%s)" % ",".join(str(int(c)) for c in camera_ids)
+
+    # Whole days from the day rollup, the partial day from minutes
+    rows = db.execute(
+        text(f"""
+            SELECT camera_id, direction, SUM(count) FROM alert_rollups
+            WHERE (
+                (granularity = 'day' AND bucket_start < :day_floor) OR
+                (granularity = 'minute' AND bucket_start >= :day_floor AND bucket_start < :before)
+            ) {camera_filter}
+            GROUP BY camera_id, direction
+        """),
+        params,
+    ).fetchall()
+
+    net = {}
+    for cam_id, direction, total in rows:
+        sign = 1 if direction == "IN" else -1
+        net[cam_id] = net.get(cam_id, 0) + sign * int(total or 0)
+    return net
+
+
+def occupancy_series(db, start_ms, end_ms, bucket_ms, camera_ids=None):
+    """
+    IN/OUT counts and running net occupancy per camera between `start_ms` and
+    `end_ms` (epoch milliseconds, end exclusive), grouped into `bucket_ms` buckets.
+
+    Buckets are aligned to multiples of `bucket_ms` since the epoch. Raises
+    ValueError for bucket sizes that are not whole minutes or ranges that
+    would produce more than MAX_BUCKETS buckets.
+    """
+    if bucket_ms <= 0 or end_ms <= start_ms:
+        raise ValueError("Invalid range or bucket size")
+
+    granularity = pick_granularity(bucket_ms)
+    if granularity is None:
+        raise ValueError("bucket_ms must be a multiple of 60000 (one minute)")
+
+    first_bucket = start_ms - start_ms % bucket_ms
+    n_buckets = (end_ms - first_bucket + bucket_ms - 1) // bucket_ms
+    if n_buckets > MAX_BUCKETS:
+        raise ValueError(f"Range produces {n_buckets} buckets (max {MAX_BUCKETS})")
+
+    range_start = first_bucket // 1000
+    range_end = (first_bucket + n_buckets * bucket_ms) // 1000
+
+    params = {
+        "granularity": granularity,
+        "range_start": range_start,
+        "range_end": range_end,
+        "bucket_ms": bucket_ms,
+    }
+    camera_filter = ""
+    if camera_ids:
+        camera_filter = "AND camera_id IN (%s)" % ",".join(str(int(c)) for c in camera_ids)
+
+    rows = db.execute(
+        text(f"""
+            SELECT camera_id, (bucket_start * 1000 / :bucket_ms) * :bucket_ms AS t, direction, SUM(count)
+            FROM alert_rollups
+            WHERE granularity = :granularity
+              AND bucket_start >= :range_start AND bucket_start < :range_end
+              {camera_filter}
+            GROUP BY camera_id, t, direction
+        """),
+        params,
+    ).fetchall()
+
+    counts = {}
+    for cam_id, t, direction, total in rows:
+        idx = (t - first_bucket) // bucket_ms
+        cam_counts = counts.setdefault(cam_id, {})
+        bucket = cam_counts.setdefault(idx, [0, 0])
+        bucket[0 if direction == "IN" else 1] += int(total or 0)
+
+    baseline = _sum_before(db, camera_ids, range_start)
+
+    ids = sorted(set(camera_ids or []) | set(counts) | set(baseline))
+    cameras = []
+    for cam_id in ids:
+        cam_counts = counts.get(cam_id, {})
+        occupancy = baseline.get(cam_id, 0)
+        series = []
+        for idx in range(n_buckets):
+            in_count, out_count = cam_counts.get(idx, (0, 0))
+            occupancy += in_count - out_count
+            series.append({
+                "t": first_bucket + idx * bucket_ms,
+                "in": in_count,
+                "out": out_count,
+                "net": in_count - out_count,
+                "occupancy": occupancy,
+            })
+        cameras.append({
+            "camera_id": cam_id,
+            "baseline": baseline.get(cam_id, 0),
+            "series": series,
+        })
+
+    return {
+        "start": first_bucket,
+        "end": first_bucket + n_buckets * bucket_ms,
+        "bucket_ms": bucket_ms,
+        "granularity": granularity,
+        "cameras": cameras,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain alert rollups")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--camera", type=int, default=None, help="Only rebuild this camera")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        rows = rebuild_rollups(db, camera_id=args.camera)
+        print(f"Rebuilt alert rollups: {rows} rows")
+    finally:
+        db.close()
@@ -0,0 +1,454 @@
+"""
+Counting rules evaluated by the rule engine.
+
+A camera carries a list of named rules stored in normalized (0..1) coordinates:
+
+    {"name": "door_a", "type": "line", "line": {...}, "polygon": [...],
+     "in_label": "IN", "out_label": "OUT", "cooldown": 3}
+    {"name": "lobby", "type": "zone", "polygon": [...],
+     "in_label": "ENTER", "out_label": "EXIT"}
+    {"name": "queue", "type": "dwell", "polygon": [...],
+     "dwell_seconds": 30, "max_occupancy": 5}
+
+Labels become part of alert image filenames, so they are limited to
+LABEL_PATTERN. Only line rules feed the IN/OUT counts (stats, rollups): a
+crossing towards `in_label` counts as "IN" whatever the label reads.
+
+Legacy configs with a single top-level `polygon` and `line` load as one line
+rule named "default".
+"""
+
+import re
+
+import cv2
+import numpy as np
+
+from track_state import TrackStateStore
+
+RULE_TYPES = ("line", "zone", "dwell")
+
+DEFAULT_COOLDOWN = 3
+LINE_THRESHOLD = 10  # Pixel distance a track must be from the line on both sides
+
+LINE_KEYS = ("x1", "y1", "x2", "y2")
+LABEL_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+LABEL_KEYS = {
+    "line": ("in_label", "out_label"),
+    "zone": ("in_label", "out_label"),
+    "dwell": ("label", "occupancy_label"),
+}
+
+
+def normalize_points(pts, w, h):
+    norm = []
+    for p in pts or []:
+        # Handle both list [x,y] and dict {"x":x, "y":y}
+        if isinstance(p, (list, tuple)) and len(p) == 2:
+            px, py = p[0], p[1]
+        elif isinstance(p, dict):
+            px, py = p.get("x", 0), p.get("y", 0)
+        else:
+            continue
+
+        # Normalize if they look like absolute pixels
+        nx = px / w if px > 1.0 else px
+        ny = py / h if py > 1.0 else py
+        norm.append({"x": nx, "y": ny})
+    return norm
+
+
+def normalize_line(l, w, h):
+    res = {}
+    for k in LINE_KEYS:
+        val = (l or {}).get(k, 0)
+        res[k] = val / (w if "x" in k else h) if val > 1.0 else val
+    return res
+
+
+def needs_resolution(config):
+    """True if any coordinate in a config looks like absolute pixels."""
+    def points_abs(pts):
+        for p in pts or []:
+            vals = p if isinstance(p, (list, tuple)) else [(p or {}).get("x", 0), (p or {}).get("y", 0)]
+            if any(v > 1.0 for v in vals):
+                return True
+        return False
+
+    def line_abs(l):
+        return any((l or {}).get(k, 0) > 1.0 for k in ["x1", "y1", "x2", "y2"])
+
+    if points_abs(config.get("polygon")) or line_abs(config.get("line")):
+        return True
+    return any(points_abs(r.get("polygon")) or line_abs(r.get("line")) for r in config.get("rules") or [])
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _check_points(pts, where):
+    if not pts:
+        return
+    if not isinstance(pts, list):
+        raise ValueError(f"{where}: polygon must be a list of points")
+    for p in pts:
+        if isinstance(p, (list, tuple)) and len(p) == 2:
+            vals = p
+        elif isinstance(p, dict):
+            vals = [p.get("x", 0), p.get("y", 0)]
+        else:
+            raise ValueError(f"{where}: polygon points must be [x, y] or {{\"x\": x, \"y\": y}}")
+        if not all(_is_number(v) for v in vals):
+            raise ValueError(f"{where}: polygon coordinates must be numbers")
+
+
+def _check_line(line, where):
+    if not line:
+        return
+    if not isinstance(line, dict) or not all(_is_number(line.get(k, 0)) for k in LINE_KEYS):
+        raise ValueError(f"{where}: line must be an object with numeric x1, y1, x2, y2")
+
+
+def check_geometry(config):
+    """
+    Check the JSON shapes of a config's polygon, line and rules before they
+    are normalized. Raises ValueError.
+    """
+    _check_points(config.get("polygon"), "Config")
+    _check_line(config.get("line"), "Config")
+    rules = config.get("rules")
+    if not rules:
+        return
+    if not isinstance(rules, list):
+        raise ValueError("rules must be a list")
+    for i, rule in enumerate(rules):
+        if not isinstance(rule, dict):
+            raise ValueError(f"Rule {i} must be an object")
+        _check_points(rule.get("polygon"), f"Rule {i}")
+        _check_line(rule.get("line"), f"Rule {i}")
+
+
+def _number(value, what):
+    if not _is_number(value):
+        raise ValueError(f"{what} must be a number")
+    return float(value)
+
+
+def _clamp_points(pts):
+    return [{"x": min(max(p["x"], 0.0), 1.0), "y": min(max(p["y"], 0.0), 1.0)} for p in pts]
+
+
+def _clamp_line(line):
+    return {k: min(max(line.get(k, 0), 0.0), 1.0) for k in LINE_KEYS}
+
+
+def validate_rule(rule, index=0):
+    """Fill defaults and check a rule definition. Raises ValueError."""
+    if not isinstance(rule, dict):
+        raise ValueError(f"Rule {index} must be an object")
+
+    rule_type = rule.get("type", "line")
+    if rule_type not in RULE_TYPES:
+        raise ValueError(f"Rule {index}: unknown type '{rule_type}'")
+
+    out = dict(rule)
+    out["type"] = rule_type
+    out["name"] = str(rule.get("name") or f"rule_{index + 1}")
+    out["cooldown"] = _number(rule.get("cooldown", DEFAULT_COOLDOWN), f"Rule '{out['name']}': cooldown")
+
+    _check_points(rule.get("polygon"), f"Rule '{out['name']}'")
+    _check_line(rule.get("line"), f"Rule '{out['name']}'")
+
+    # Accept [x, y] pairs as well as {"x": x, "y": y} points
+    polygon = normalize_points(rule.get("polygon"), 1, 1)
+    out["polygon"] = polygon
+    if any(not 0.0 <= v <= 1.0 for p in polygon for v in (p["x"], p["y"])):
+        raise ValueError(f"Rule '{out['name']}': polygon coordinates must be normalized to 0..1")
+    if rule_type == "line":
+        line = rule.get("line")
+        if not line or not all(k in line for k in LINE_KEYS):
+            raise ValueError(f"Rule '{out['name']}': line rules need a line")
+        if any(not 0.0 <= line[k] <= 1.0 for k in LINE_KEYS):
+            raise ValueError(f"Rule '{out['name']}': line coordinates must be normalized to 0..1")
+        if polygon and len(polygon) < 3:
+            raise ValueError(f"Rule '{out['name']}': polygon needs at least 3 points")
+        out.setdefault("in_label", "IN")
+        out.setdefault("out_label", "OUT")
+    else:
+        if len(polygon) < 3:
+            raise ValueError(f"Rule '{out['name']}': {rule_type} rules need a polygon")
+        if rule_type == "zone":
+            out.setdefault("in_label", "ENTER")
+            out.setdefault("out_label", "EXIT")
+        else:
+            out.setdefault("label", "DWELL")
+            out.setdefault("occupancy_label", "OCCUPANCY")
+            out["dwell_seconds"] = _number(rule.get("dwell_seconds", 30), f"Rule '{out['name']}': dwell_seconds")
+            if rule.get("max_occupancy") is not None:
+                out["max_occupancy"] = int(_number(rule["max_occupancy"], f"Rule '{out['name']}': max_occupancy"))
+
+    labels = [out[k] for k in LABEL_KEYS[rule_type]]
+    for label in labels:
+        if not isinstance(label, str) or not LABEL_PATTERN.match(label):
+            raise ValueError(
+                f"Rule '{out['name']}': labels must be 1-32 letters, digits, '_' or '-' (got {label!r})"
+            )
+    if len(set(labels)) != len(labels):
+        raise ValueError(f"Rule '{out['name']}': labels must differ")
+    return out
+
+
+def validate_rules(rules):
+    rules = [validate_rule(r, i) for i, r in enumerate(rules or [])]
+    names = [r["name"] for r in rules]
+    if len(names) != len(set(names)):
+        raise ValueError("Rule names must be unique")
+    return rules
+
+
+def load_rules(config):
+    """Rule definitions from an internal camera config, legacy format included."""
+    if config.get("rules"):
+        return validate_rules(config["rules"])
+
+    polygon = config.get("polygon")
+    line = config.get("line")
+    if polygon and line:
+        # Shapes drawn in the UI can overshoot the canvas edge slightly
+        polygon = _clamp_points(normalize_points(polygon, 1, 1))
+        line = _clamp_line(line)
+        return [validate_rule({"name": "default", "type": "line", "polygon": polygon, "line": line})]
+    return []
+
+
+def update_default_rule(rules, polygon=None, line=None):
+    """
+    Copy a polygon and/or line drawn in the UI onto the line rule named
+    "default". Returns the validated rules, or None if there is no such rule.
+    """
+    _check_points(polygon, "Polygon")
+    _check_line(line, "Line")
+    rules = [dict(r) for r in rules]
+    for rule in rules:
+        if rule.get("name") == "default" and rule.get("type", "line") == "line":
+            if polygon is not None:
+                rule["polygon"] = _clamp_points(normalize_points(polygon, 1, 1))
+            if line is not None:
+                rule["line"] = _clamp_line(line)
+            return validate_rules(rules)
+    return None
+
+
+def normalize_rule(rule, w, h):
+    out = dict(rule)
+    if rule.get("polygon"):
+        out["polygon"] = normalize_points(rule["polygon"], w, h)
+    if rule.get("line"):
+        out["line"] = normalize_line(rule["line"], w, h)
+    return out
+
+
+def rule_to_pixels(rule, w, h):
+    """Portable (absolute pixel) form of a normalized rule."""
+    out = dict(rule)
+    if rule.get("polygon"):
+        out["polygon"] = [[int(p["x"] * w), int(p["y"] * h)] for p in rule["polygon"]]
+    if rule.get("line"):
+        l = rule["line"]
+        out["line"] = {
+            "x1": int(l.get("x1", 0) * w),
+            "y1": int(l.get("y1", 0) * h),
+            "x2": int(l.get("x2", 0) * w),
+            "y2": int(l.get("y2", 0) * h)
+        }
+    return out
+
+
+def oriented_line(line, w, h):
+    """
+    Denormalize a line and ENFORCE a robust direction: endpoints are sorted
+    along the dominant axis so "forward" is stable however it was drawn.
+    """
+    lx1_raw = int(line["x1"] * w)
+    ly1_raw = int(line["y1"] * h)
+    lx2_raw = int(line["x2"] * w)
+    ly2_raw = int(line["y2"] * h)
+
+    dx = lx2_raw - lx1_raw
+    dy = ly2_raw - ly1_raw
+
+    if abs(dx) > abs(dy): # More horizontal
+        if lx1_raw > lx2_raw:
+            return lx2_raw, ly2_raw, lx1_raw, ly1_raw
+    else: # More vertical
+        if ly1_raw > ly2_raw:
+            return lx2_raw, ly2_raw, lx1_raw, ly1_raw
+    return lx1_raw, ly1_raw, lx2_raw, ly2_raw
+
+
+class Rule:
+    """Base class: one rule, its geometry at the current resolution and its track state."""
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.name = spec["name"]
+        self.type = spec["type"]
+        self.states = TrackStateStore(cooldown=spec["cooldown"])
+        self.resolution = None
+        self.polygon = None
+
+    def compile(self, width, height):
+        if self.resolution == (width, height):
+            return
+        self.resolution = (width, height)
+        polygon = self.spec.get("polygon")
+        if polygon:
+            self.polygon = np.array([[int(p["x"] * width), int(p["y"] * height)] for p in polygon], np.int32)
+        else:
+            self.polygon = None
+
+    def inside(self, cx, cy):
+        if self.polygon is None:
+            return True
+        return cv2.pointPolygonTest(self.polygon, (float(cx), float(cy)), False) >= 0
+
+    def begin_frame(self, now=None):
+        self.states.begin_frame(now)
+
+    def mark_seen(self, track_ids):
+        self.states.mark_seen(track_ids)
+
+    def evaluate(self, track_id, cx, cy):
+        """Label to alert with for this detection, or None."""
+        raise NotImplementedError
+
+    def direction_of(self, label):
+        """"IN" / "OUT" for labels that count towards occupancy, else None."""
+        return None
+
+    def end_frame(self):
+        """Label for a frame-level (not per-track) alert, or None."""
+        return None
+
+    def clear(self):
+        self.states.clear()
+
+
+class LineRule(Rule):
+    def direction_of(self, label):
+        if label == self.spec["in_label"]:
+            return "IN"
+        if label == self.spec["out_label"]:
+            return "OUT"
+        return None
+
+    def compile(self, width, height):
+        if self.resolution == (width, height):
+            return
+        super().compile(width, height)
+        self.line = oriented_line(self.spec["line"], width, height)
+        lx1, ly1, lx2, ly2 = self.line
+        self.line_len = np.sqrt((lx2 - lx1)**2 + (ly2 - ly1)**2) + 1e-6
+
+    def evaluate(self, track_id, cx, cy):
+        lx1, ly1, lx2, ly2 = self.line
+
+        # Calculate side (cross product), normalized to pixel distance
+        side = ((lx2 - lx1) * (cy - ly1) - (ly2 - ly1) * (cx - lx1)) / self.line_len
+
+        if not self.inside(cx, cy):
+            return None
+
+        states = self.states
+        state = states.get(track_id)
+        if state is None:
+            states.update(track_id, side)
+            return None
+
+        previous_side = state.side
+        state.side = side
+
+        # CROSSING LOGIC
+        if (
+            abs(previous_side) > LINE_THRESHOLD and
+            abs(side) > LINE_THRESHOLD and
+            previous_side * side < 0 and
+            not states.in_cooldown(state)
+        ):
+            states.mark_alert(state)
+            return self.spec["in_label"] if side > 0 else self.spec["out_label"]
+        return None
+
+
+class ZoneRule(Rule):
+    def evaluate(self, track_id, cx, cy):
+        side = 1 if self.inside(cx, cy) else -1
+
+        states = self.states
+        state = states.get(track_id)
+        if state is None:
+            states.update(track_id, side)
+            return None
+
+        previous_side = state.side
+        state.side = side
+
+        if previous_side != side and not states.in_cooldown(state):
+            states.mark_alert(state)
+            return self.spec["in_label"] if side > 0 else self.spec["out_label"]
+        return None
+
+
+class DwellRule(Rule):
+    def __init__(self, spec):
+        super().__init__(spec)
+        self.occupancy = 0
+        self.last_occupancy_alert = None
+
+    def begin_frame(self, now=None):
+        super().begin_frame(now)
+        self.occupancy = 0
+
+    def evaluate(self, track_id, cx, cy):
+        states = self.states
+        state = states.get(track_id)
+
+        if not self.inside(cx, cy):
+            if state is not None:
+                state.side = -1
+            return None
+
+        self.occupancy += 1
+        now = states.now
+        if state is None or state.side < 0:
+            # Entered (or re-entered) the zone: restart the dwell timer
+            state = states.update(track_id, 1)
+            state.since = now
+            state.last_alert = None
+            return None
+
+        if state.last_alert is None and now - state.since >= self.spec["dwell_seconds"]:
+            states.mark_alert(state)
+            return self.spec["label"]
+        return None
+
+    def end_frame(self):
+        max_occupancy = self.spec.get("max_occupancy")
+        if max_occupancy is None or self.occupancy <= max_occupancy:
+            return None
+        now = self.states.now
+        if self.last_occupancy_alert is not None and now - self.last_occupancy_alert <= self.spec["cooldown"]:
+            return None
+        self.last_occupancy_alert = now
+        return self.spec["occupancy_label"]
+
+
+RULE_CLASSES = {
+    "line": LineRule,
+    "zone": ZoneRule,
+    "dwell": DwellRule,
+}
+
+
+def build_rules(specs):
+    return [RULE_CLASSES[spec["type"]](spec) for spec in specs]
@@ -0,0 +1,341 @@
+"""
+Camera ownership across backend instances through leases in the shared DB.
+
+Every node heartbeats into `cluster_nodes`. Each camera is placed on one live
+node by rendezvous hashing, so all nodes agree on placement without talking
+to each other; the chosen node takes a time-limited lease in
+`camera_leases` and keeps renewing it while it runs the camera's engine.
+
+- Failover: a node that stops heartbeating drops out of placement, and its
+  leases are taken over once they expire.
+- Status: each renewal also stores the engine's status on the lease row,
+  so any node can report every camera's state.
+- Rebalancing: when a node joins, the cameras that now hash to it are
+  released by their current owner and picked up on the next round.
+
+Stopping an engine only signals it; its lease is kept (and renewed) until
+the engine's thread has exited, so a slow stop never lets another node run
+the same camera, and a round never waits on an engine.
+
+Node IDs must be unique among live nodes. NODE_ID defaults to the hostname
+plus a random suffix, since replicas on one host (network_mode: host, PID 1
+in every container) would otherwise share an ID. A process refuses to
+start while another live process heartbeats under the same ID.
+
+Several local processes can share one database file:
+
+    DATABASE_URL=sqlite:////tmp/cams.db python sharding.py --node a --cameras 10
+    DATABASE_URL=sqlite:////tmp/cams.db python sharding.py --node b --cameras 10
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import uuid
+
+from sqlalchemy.dialects.sqlite import insert
+
+from database import SessionLocal, engine, Base, upgrade_schema
+from models import CameraLease, ClusterNode
+
+NODE_ID = os.environ.get("NODE_ID") or f"{socket.gethostname()}-{uuid.uuid4().hex[:12]}"
+LEASE_SECONDS = float(os.environ.get("LEASE_SECONDS", 15))
+
+
+def rendezvous_owner(camera_id, node_ids):
+    """Highest-random-weight node for a camera; stable as long as the node set is."""
+    if not node_ids:
+        return None
+    return max(
+        node_ids,
+        key=lambda node_id: hashlib.sha1(f"{node_id}:{camera_id}".encode()).hexdigest()
+    )
+
+
+class LeaseManager:
+    """
+    Keeps this node's set of running engines equal to the cameras it holds
+    leases for.
+
+    `list_cameras()` returns {camera_id: version} from the shared database; a
+    changed version restarts that camera's engine on its owner.
+    `start_engine(camera_id)` / `stop_engine(camera_id)` run on this node only;
+    `stop_engine` must not block. `engine_alive(camera_id)` tells whether a
+    stopped engine is still running (default: engines stop at once).
+    `engine_status(camera_id)` returns a JSON-able dict (or None) stored on
+    the lease at each renewal.
+    """
+
+    def __init__(self, list_cameras, start_engine, stop_engine, engine_alive=None, engine_status=None,
+                 node_id=NODE_ID, lease_seconds=LEASE_SECONDS, interval=None):
+        self.node_id = node_id
+        self.instance = uuid.uuid4().hex
+        self.list_cameras = list_cameras
+        self.start_engine = start_engine
+        self.stop_engine = stop_engine
+        self.engine_alive = engine_alive or (lambda camera_id: False)
+        self.engine_status = engine_status or (lambda camera_id: None)
+        self.lease_seconds = lease_seconds
+        self.interval = interval if interval is not None else lease_seconds / 3.0
+        self.running = {}  # camera_id -> version the engine was started with
+        self.lease_expiry = {}  # camera_id -> local view of our lease expiry
+        self.stopping = set()  # cameras whose engine was told to stop and may still run
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Claim the node ID and start placing cameras. Raises RuntimeError if the ID is in use."""
+        db = SessionLocal()
+        try:
+            claimed = self._heartbeat(db, time.time())
+        finally:
+            db.close()
+        if not claimed:
+            raise RuntimeError(
+                f"Node ID '{self.node_id}' is already in use by a live node; set a unique NODE_ID"
+            )
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def wake(self):
+        """Run a round now (after a deploy, config upload or delete)."""
+        self._wake.set()
+
+    def status(self):
+        db = SessionLocal()
+        try:
+            now = time.time()
+            nodes = [
+                {"node_id": n.id, "heartbeat": n.heartbeat, "alive": n.heartbeat >= now - self.lease_seconds}
+                for n in db.query(ClusterNode).order_by(ClusterNode.id).all()
+            ]
+            leases = [
+                {"camera_id": l.camera_id, "node_id": l.node_id, "expires_at": l.expires_at, "valid": l.expires_at >= now}
+                for l in db.query(CameraLease.camera_id, CameraLease.node_id, CameraLease.expires_at)
+                .order_by(CameraLease.camera_id).all()
+            ]
+        finally:
+            db.close()
+        return {
+            "node_id": self.node_id,
+            "running": sorted(self.running),
+            "stopping": sorted(self.stopping),
+            "nodes": nodes,
+            "leases": leases,
+        }
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Lease manager ({self.node_id}): round failed: {e}")
+                self._drop_expired()
+            # Poll sooner while engines are stopping so restarts and hand-overs are quick
+            self._wake.wait(min(self.interval, 0.5) if self.stopping else self.interval)
+            self._wake.clear()
+
+    def _drop_expired(self):
+        # Without a DB we cannot renew; stop anything whose lease has run out
+        now = time.time()
+        with self._lock:
+            for camera_id in list(self.running):
+                if self.lease_expiry.get(camera_id, 0) < now:
+                    print(f"Lease manager ({self.node_id}): lease for camera {camera_id} lapsed, stopping")
+                    self._stop_local(camera_id)
+
+    def _stop_local(self, camera_id):
+        self.running.pop(camera_id, None)
+        self.lease_expiry.pop(camera_id, None)
+        self.stopping.add(camera_id)
+        self.stop_engine(camera_id)
+
+    def _reap(self, db, owned, now, expires):
+        """Renew leases of engines still stopping; release the rest once they have exited."""
+        for camera_id in list(self.stopping):
+            if self.engine_alive(camera_id):
+                if camera_id not in owned:
+                    self._acquire(db, camera_id, now, expires)
+                continue
+            self.stopping.discard(camera_id)
+            if camera_id not in owned:
+                self._release(db, camera_id)
+
+    def tick(self):
+        with self._lock:
+            now = time.time()
+            expires = now + self.lease_seconds
+            cameras = self.list_cameras()
+
+            db = SessionLocal()
+            try:
+                if not self._heartbeat(db, now):
+                    # Another process took over this ID after our heartbeat lapsed
+                    print(f"Lease manager ({self.node_id}): node ID claimed by another process, stopping engines")
+                    for camera_id in list(self.running):
+                        self._stop_local(camera_id)
+                    self.stopping = {c for c in self.stopping if self.engine_alive(c)}
+                    return
+
+                live = [
+                    n.id for n in db.query(ClusterNode.id)
+                    .filter(ClusterNode.heartbeat >= now - self.lease_seconds).all()
+                ]
+                if self.node_id not in live:
+                    live.append(self.node_id)
+
+                owned = set()
+                for camera_id in cameras:
+                    if rendezvous_owner(camera_id, live) == self.node_id:
+                        if self._acquire(db, camera_id, now, expires):
+                            owned.add(camera_id)
+                    elif camera_id in self.running:
+                        # Rebalance: hand the camera to the node it now hashes to
+                        self._stop_local(camera_id)
+
+                for camera_id in list(self.running):
+                    if camera_id not in cameras:
+                        self._stop_local(camera_id)
+
+                self._reap(db, owned, now, expires)
+                db.commit()
+            finally:
+                db.close()
+
+            for camera_id in owned:
+                self.lease_expiry[camera_id] = expires
+                version = cameras[camera_id]
+                if camera_id in self.running:
+                    if self.running[camera_id] == version:
+                        continue
+                    print(f"Lease manager ({self.node_id}): config changed, restarting camera {camera_id}")
+                    self._stop_local(camera_id)
+                if camera_id in self.stopping:
+                    if self.engine_alive(camera_id):
+                        continue  # started on a later round, once the old engine has exited
+                    self.stopping.discard(camera_id)
+                self.running[camera_id] = version
+                self.start_engine(camera_id)
+
+            # Lost a lease we thought we had (e.g. expired during a long pause)
+            for camera_id in list(self.running):
+                if camera_id in cameras and camera_id not in owned:
+                    self._stop_local(camera_id)
+
+    def _heartbeat(self, db, now):
+        """Upsert our heartbeat unless another live process holds the node ID. Returns success."""
+        result = db.execute(
+            insert(ClusterNode)
+            .values(id=self.node_id, heartbeat=now, instance=self.instance)
+            .on_conflict_do_update(
+                index_elements=["id"],
+                set_={"heartbeat": now, "instance": self.instance},
+                where=(
+                    (ClusterNode.instance == self.instance) |
+                    ClusterNode.instance.is_(None) |
+                    (ClusterNode.heartbeat < now - self.lease_seconds)
+                )
+            )
+        )
+        db.commit()
+        return result.rowcount == 1
+
+    def _acquire(self, db, camera_id, now, expires):
+        status = self.engine_status(camera_id)
+        if status is not None:
+            status = json.dumps(dict(status, reported_at=now))
+        db.execute(
+            insert(CameraLease)
+            .values(camera_id=camera_id, node_id=self.node_id, expires_at=expires, status=status)
+            .on_conflict_do_nothing(index_elements=["camera_id"])
+        )
+        # Conditional update is atomic: only the holder or a taker of an expired lease wins
+        updated = (
+            db.query(CameraLease)
+            .filter(
+                CameraLease.camera_id == camera_id,
+                (CameraLease.node_id == self.node_id) | (CameraLease.expires_at < now)
+            )
+            .update(
+                {CameraLease.node_id: self.node_id, CameraLease.expires_at: expires, CameraLease.status: status},
+                synchronize_session=False,
+            )
+        )
+        db.commit()
+        return updated == 1
+
+    def _release(self, db, camera_id):
+        db.query(CameraLease).filter(
+            CameraLease.camera_id == camera_id,
+            CameraLease.node_id == self.node_id
+        ).update({CameraLease.expires_at: 0, CameraLease.status: None}, synchronize_session=False)
+
+    def stop(self):
+        """Stop every local engine and give up leases so other nodes take over at once."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        with self._lock:
+            for camera_id in list(self.running):
+                self._stop_local(camera_id)
+            deadline = time.time() + self.lease_seconds / 3.0
+            while any(self.engine_alive(c) for c in self.stopping) and time.time() < deadline:
+                time.sleep(0.1)
+            db = SessionLocal()
+            try:
+                for camera_id in sorted(self.stopping):
+                    if self.engine_alive(camera_id):
+                        print(f"Lease manager ({self.node_id}): camera {camera_id} still stopping, releasing anyway")
+                    self._release(db, camera_id)
+                self.stopping.clear()
+                db.query(ClusterNode).filter(
+                    ClusterNode.id == self.node_id,
+                    ClusterNode.instance == self.instance
+                ).delete(synchronize_session=False)
+                db.commit()
+            except Exception as e:
+                print(f"Lease manager ({self.node_id}): failed to release leases: {e}")
+            finally:
+                db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a lease manager with no-op engines")
+    parser.add_argument("--node", default=NODE_ID)
+    parser.add_argument("--cameras", type=int, default=10, help="Number of fake cameras (ids 1..N)")
+    parser.add_argument("--lease", type=float, default=LEASE_SECONDS)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema()
+
+    manager = LeaseManager(
+        list_cameras=lambda: {i: 0 for i in range(1, args.cameras + 1)},
+        start_engine=lambda cid: print(f"[{args.node}] start camera {cid}"),
+        stop_engine=lambda cid: print(f"[{args.node}] stop camera {cid}"),
+        node_id=args.node,
+        lease_seconds=args.lease,
+    )
+    try:
+        manager.start()
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
+    # Treat SIGTERM like Ctrl+C so a stopped node hands its cameras over at once
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        while True:
+            time.sleep(args.lease)
+            print(f"[{args.node}] owns {sorted(manager.running)}")
+    except KeyboardInterrupt:
+        manager.stop()
@@ -0,0 +1,404 @@
+"""
+Video source helpers for the rule engine.
+
+CaptureSupervisor wraps cv2.VideoCapture for long-running streams: it reopens
+dead or stalled sources with exponential backoff and jitter, and reports the
+connection state.
+
+When a camera has a low-resolution `analysis_url`, detection and tracking run
+on that substream and alert snapshots are taken from the main `url` through a
+SnapshotSource. A live main stream is only demuxed (PacketRing, PyAV) and
+decoded when an alert needs a snapshot.
+"""
+
+import random
+import threading
+import time
+
+import cv2
+
+
+def is_file_source(url):
+    """Local video files (no scheme) can be seeked; live streams cannot."""
+    return "://" not in str(url)
+
+
+def map_box(box, from_size, to_size):
+    """Scale an (x1, y1, x2, y2) box between two (width, height) resolutions."""
+    fw, fh = from_size
+    tw, th = to_size
+    sx = tw / float(fw)
+    sy = th / float(fh)
+    x1, y1, x2, y2 = box
+    return [int(x1 * sx), int(y1 * sy), int(x2 * sx), int(y2 * sy)]
+
+
+def open_capture(url, timeout_seconds=None):
+    """VideoCapture with FFMPEG open/read timeouts for network streams."""
+    if timeout_seconds and not is_file_source(url):
+        ms = int(timeout_seconds * 1000)
+        try:
+            return cv2.VideoCapture(url, cv2.CAP_FFMPEG, [
+                cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, ms,
+                cv2.CAP_PROP_READ_TIMEOUT_MSEC, ms,
+            ])
+        except (AttributeError, TypeError, cv2.error):
+            pass
+    return cv2.VideoCapture(url) # Let OpenCV auto-select backend
+
+
+class CaptureSupervisor:
+    """
+    Self-healing capture for one stream.
+
+    read() / grab() only return False once `stop_event` is set; in between,
+    a failed read, a source that never opens, or a stall (no frame, or a
+    frame timestamp that stops advancing, for `stall_timeout` seconds) closes
+    the capture and reopens it after an exponential backoff with jitter. The
+    backoff resets after a connection has been healthy for `stall_timeout`.
+
+    `last_gap` is the length of the most recent outage in seconds, so callers
+    can keep tracking state across short drops and reset it after long ones.
+    """
+
+    def __init__(self, url, name="", stop_event=None, stall_timeout=10.0,
+                 min_backoff=1.0, max_backoff=60.0, open_fn=None):
+        self.url = url
+        self.name = name
+        self.stop_event = stop_event or threading.Event()
+        self.stall_timeout = stall_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.open_fn = open_fn or (lambda u: open_capture(u, stall_timeout))
+
+        self.state = "connecting"
+        self.reconnects = 0
+        self.failures = 0
+        self.last_error = None
+        self.last_frame_time = None
+        self.connected_since = None
+        self.last_gap = 0.0
+
+        self._cap = None
+        self._lock = threading.Lock()
+        self._backoff = min_backoff
+        self._last_pos = None
+        self._last_progress = None
+        self._stalled = threading.Event()
+        self._watchdog = None
+
+    def start(self):
+        self._watchdog = threading.Thread(target=self._watch, daemon=True)
+        self._watchdog.start()
+        return self
+
+    def status(self):
+        now = time.time()
+        return {
+            "url": self.url,
+            "state": self.state,
+            "reconnects": self.reconnects,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_frame_age": round(now - self.last_frame_time, 3) if self.last_frame_time else None,
+            "connected_for": round(now - self.connected_since, 3) if self.connected_since else None,
+            "last_gap": round(self.last_gap, 3),
+        }
+
+    def _watch(self):
+        # Frame-timestamp watchdog: flags a capture that stopped delivering new frames.
+        # A read blocked on a dead socket is unblocked by the FFMPEG read timeout.
+        while not self.stop_event.wait(min(1.0, self.stall_timeout / 4.0)):
+            last = self._last_progress
+            if (
+                self.state == "connected" and not self._stalled.is_set() and
+                last is not None and time.time() - last > self.stall_timeout
+            ):
+                print(f"{self.name}: no new frames for {self.stall_timeout}s, reconnecting")
+                self._stalled.set()
+
+    def _open(self):
+        cap = self.open_fn(self.url)
+        if cap is not None and cap.isOpened():
+            with self._lock:
+                self._cap = cap
+            self._stalled.clear()
+            self._last_pos = None
+            now = time.time()
+            self._last_progress = now
+            if self.last_frame_time is not None:
+                self.last_gap = now - self.last_frame_time
+            self.state = "connected"
+            self.connected_since = now
+            return True
+        if cap is not None:
+            cap.release()
+        return False
+
+    def _fail(self, reason):
+        with self._lock:
+            cap, self._cap = self._cap, None
+        if cap is not None:
+            cap.release()
+        self.failures += 1
+        self.last_error = reason
+        self.connected_since = None
+        self.state = "reconnecting"
+
+        # Exponential backoff with full jitter, interruptible by stop
+        delay = random.uniform(self.min_backoff, self._backoff)
+        self._backoff = min(self._backoff * 2, self.max_backoff)
+        print(f"{self.name}: {reason}. Reconnecting in {delay:.1f}s...")
+        self.stop_event.wait(delay)
+
+    def _next(self, op):
+        while not self.stop_event.is_set():
+            with self._lock:
+                cap = self._cap
+            if cap is None:
+                was_connected_before = self.last_frame_time is not None or self.failures > 0
+                if not self._open():
+                    self._fail("could not open stream")
+                    continue
+                if was_connected_before:
+                    self.reconnects += 1
+                with self._lock:
+                    cap = self._cap
+
+            result = op(cap)
+            ok = result[0] if isinstance(result, tuple) else result
+            if self._stalled.is_set():
+                self._fail("stream stalled")
+                continue
+            if not ok:
+                self._fail("read failed")
+                continue
+
+            now = time.time()
+            self.last_frame_time = now
+            # Backoff starts over only once a connection has stayed up for a while,
+            # so a source that accepts and then drops keeps backing off
+            if now - self.connected_since >= self.stall_timeout:
+                self._backoff = self.min_backoff
+
+            # Progress = a new frame timestamp (sources that report none always progress)
+            pos = cap.get(cv2.CAP_PROP_POS_MSEC)
+            if not pos or pos != self._last_pos:
+                self._last_progress = now
+            self._last_pos = pos
+            return result
+        self.state = "stopped"
+        return (False, None) if op is _read else False
+
+    def read(self):
+        return self._next(_read)
+
+    def grab(self):
+        return self._next(_grab)
+
+    def retrieve(self):
+        with self._lock:
+            cap = self._cap
+            if cap is None:
+                return False, None
+            return cap.retrieve()
+
+    def get(self, prop):
+        with self._lock:
+            return self._cap.get(prop) if self._cap is not None else 0.0
+
+    def release(self):
+        self.stop_event.set()
+        self.state = "stopped"
+        with self._lock:
+            cap, self._cap = self._cap, None
+        if cap is not None:
+            cap.release()
+
+
+def _read(cap):
+    return cap.read()
+
+
+def _grab(cap):
+    return cap.grab()
+
+
+class PacketRing:
+    """
+    Compressed packets of a video stream since its last keyframe.
+
+    grab() demuxes one packet and never decodes it; retrieve() decodes the
+    held packets with a fresh decoder and returns the newest frame, so a
+    full-resolution stream costs decode time only when a frame is wanted.
+    Quacks like a cv2.VideoCapture for CaptureSupervisor (POS_MSEC is the
+    last packet's decode time, for stall detection).
+    """
+
+    def __init__(self, url, timeout_seconds=None, max_packets=600):
+        self.max_packets = max_packets
+        self._container = None
+        self._lock = threading.Lock()
+        self._gop = []
+        self._pos = 0.0
+        import av
+        self._av = av
+        options = {"rtsp_transport": "tcp"} if str(url).startswith("rtsp") else {}
+        try:
+            container = av.open(url, options=options, timeout=timeout_seconds)
+            stream = container.streams.video[0]
+        except (av.error.FFmpegError, OSError, IndexError) as e:
+            print(f"Could not open main stream: {e}")
+            return
+        self._container = container
+        self._stream = stream
+        self._codec_name = stream.codec_context.name
+        self._extradata = stream.codec_context.extradata
+        self._packets = container.demux(stream)
+
+    def isOpened(self):
+        return self._container is not None
+
+    def grab(self):
+        try:
+            packet = next(self._packets)
+        except (StopIteration, self._av.error.FFmpegError, OSError):
+            return False
+        if packet.size == 0:
+            return False  # end of stream
+        with self._lock:
+            if packet.is_keyframe:
+                self._gop = [packet]
+            elif self._gop:
+                if len(self._gop) < self.max_packets:
+                    self._gop.append(packet)
+                else:
+                    self._gop = []  # keyframe interval too long; wait for the next one
+        if packet.dts is not None:
+            self._pos = float(packet.dts * packet.time_base * 1000)
+        return True
+
+    def retrieve(self):
+        with self._lock:
+            packets = list(self._gop)
+        if not packets:
+            return False, None
+        av = self._av
+        codec = av.CodecContext.create(self._codec_name, "r")
+        if self._extradata:
+            codec.extradata = self._extradata
+        codec.thread_type = "AUTO"
+        latest = None
+        try:
+            # Frames come out in display order; the newest is the one with the highest pts
+            for packet in packets + [None]:
+                for frame in codec.decode(packet):
+                    if latest is None or (frame.pts or 0) >= (latest.pts or 0):
+                        latest = frame
+        except av.error.FFmpegError as e:
+            print(f"Could not decode main stream: {e}")
+        if latest is None:
+            return False, None
+        return True, latest.to_ndarray(format="bgr24")
+
+    def get(self, prop):
+        return self._pos if prop == cv2.CAP_PROP_POS_MSEC else 0.0
+
+    def release(self):
+        with self._lock:
+            self._gop = []
+        if self._container is not None:
+            self._container.close()
+            self._container = None
+
+
+class SnapshotSource:
+    """
+    Full-resolution frames from the main stream, decoded only when asked for.
+
+    Live streams are demuxed by a background thread into a PacketRing through
+    a CaptureSupervisor (reconnects, stall detection); a snapshot decodes the
+    packets since the last keyframe. File sources are seeked to the analysis
+    stream's position instead, so two local files of different resolution
+    stay in step.
+    """
+
+    def __init__(self, url, name="", stall_timeout=10.0):
+        self.url = url
+        self.name = name
+        self.seekable = is_file_source(url)
+        self.stall_timeout = stall_timeout
+        self.resolution = None
+        self._cap = None
+        self._ring = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.seekable:
+            self._cap = cv2.VideoCapture(self.url)
+        else:
+            try:
+                import av  # noqa: F401
+            except ImportError:
+                print(f"{self.name}: PyAV is not installed, snapshots use the analysis stream")
+                return self
+            self._cap = CaptureSupervisor(
+                self.url, name=f"{self.name} (snapshots)", stop_event=self._stop,
+                stall_timeout=self.stall_timeout, open_fn=self._open_ring,
+            ).start()
+            self._thread = threading.Thread(target=self._grab_loop, daemon=True)
+            self._thread.start()
+        return self
+
+    def _open_ring(self, url):
+        ring = PacketRing(url, timeout_seconds=self.stall_timeout)
+        self._ring = ring if ring.isOpened() else None
+        return ring
+
+    def _grab_loop(self):
+        while not self._stop.is_set():
+            self._cap.grab()
+
+    def get_frame(self, pos_msec=None):
+        """Latest main-stream frame (or the one at `pos_msec` for files), or None."""
+        if self.seekable:
+            with self._lock:
+                if self._cap is None:
+                    return None
+                if pos_msec is not None:
+                    self._cap.set(cv2.CAP_PROP_POS_MSEC, pos_msec)
+                ok, frame = self._cap.read()
+        else:
+            # Never waits on a reconnecting main stream: no ring, no frame, the caller falls back
+            ring = self._ring
+            if ring is None or self._cap is None or self._cap.state != "connected":
+                return None
+            ok, frame = ring.retrieve()
+        if not ok or frame is None:
+            return None
+        self.resolution = (frame.shape[1], frame.shape[0])
+        return frame
+
+    def snapshot(self, frame, box=None, pos_msec=None):
+        """
+        Main-stream frame for an alert seen on analysis `frame`, with `box`
+        mapped to the main resolution. Falls back to the analysis frame / box.
+        """
+        main_frame = self.get_frame(pos_msec)
+        if main_frame is None:
+            return frame, box
+        if box is not None:
+            box = map_box(box, (frame.shape[1], frame.shape[0]), (main_frame.shape[1], main_frame.shape[0]))
+        return main_frame, box
+
+    def release(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        with self._lock:
+            if self._cap is not None:
+                self._cap.release()
+                self._cap = None
+        self._ring = None
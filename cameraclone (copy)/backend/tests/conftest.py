@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# Backend modules are imported flat (``import rules``), as in main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# database.py reads this at import; never touch the real data/cameras.db
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/test.db")
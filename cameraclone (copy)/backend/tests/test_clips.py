@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+import clips
+from clips import ClipRecorder
+
+FPS = 10
+
+
+@pytest.fixture
+def submitted(monkeypatch):
+    out = []
+    monkeypatch.setattr(clips, "submit_clip", lambda camera_id, frames, alert_ids: out.append((frames, list(alert_ids))))
+    return out
+
+
+def _frame(i, rng=None):
+    if rng is not None:
+        return rng.integers(0, 256, (120, 160, 3), dtype=np.uint8)  # noise compresses badly
+    return np.full((120, 160, 3), i % 256, np.uint8)
+
+
+def test_overlapping_alerts_share_one_clip(submitted):
+    recorder = ClipRecorder(1, pre_seconds=2.0, post_seconds=3.0)
+    t0 = 1000.0
+    for i in range(200):
+        ts = t0 + i / FPS
+        recorder.push(_frame(i), ts)
+        if i == 50:
+            recorder.trigger(11, ts)  # clip until t0 + 8.0
+        if i == 70:
+            recorder.trigger(12, ts)  # inside it: extended to t0 + 10.0
+    recorder.close()
+
+    assert len(submitted) == 1
+    frames, alert_ids = submitted[0]
+    assert alert_ids == [11, 12]
+    assert frames[0][0] == pytest.approx(t0 + 5.0 - 2.0)
+    assert frames[-1][0] == pytest.approx(t0 + 10.0)
+
+
+def test_separate_alerts_get_separate_clips(submitted):
+    recorder = ClipRecorder(1, pre_seconds=1.0, post_seconds=1.0)
+    for i in range(100):
+        ts = i / FPS
+        recorder.push(_frame(i), ts)
+        if i in (20, 80):
+            recorder.trigger(i, ts)
+    recorder.close()
+    assert [ids for _, ids in submitted] == [[20], [80]]
+
+
+def test_memory_stays_under_max_bytes(submitted):
+    rng = np.random.default_rng(0)
+    max_bytes = 200 * 1024
+    recorder = ClipRecorder(1, pre_seconds=30.0, post_seconds=30.0, max_bytes=max_bytes)
+    for i in range(300):
+        ts = i / FPS
+        recorder.push(_frame(i, rng), ts)
+        if i % 40 == 0:
+            recorder.trigger(i, ts)
+        assert recorder._ring_bytes <= max_bytes
+        assert recorder._pending is None or recorder._pending.nbytes <= max_bytes
+    recorder.close()
+
+    # Byte-capped clips are cut and handed over, never silently truncated
+    assert len(submitted) > 1
+    assert all(sum(len(buf) for _, buf in frames) <= max_bytes for frames, _ in submitted)
+    covered = [i for _, ids in submitted for i in ids]
+    assert covered == sorted(covered)
+    assert set(covered) == set(range(0, 300, 40))
@@ -0,0 +1,115 @@
+import csv
+import gzip
+import io
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import text
+
+import exports
+from database import Base, SessionLocal, engine
+from models import Alert, AlertRollup, Camera
+
+BASE = 1700000000  # epoch seconds
+
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    session.query(AlertRollup).delete()
+    session.query(Alert).delete()
+    session.query(Camera).delete()
+    session.add_all([Camera(id=1, name="cam1", url="a.mp4"), Camera(id=2, name="cam2", url="b.mp4")])
+    session.commit()
+    yield session
+    session.close()
+
+
+def _db_time(epoch, fraction=True):
+    dt = datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None)
+    return dt.strftime("%Y-%m-%d %H:%M:%S.%f" if fraction else "%Y-%m-%d %H:%M:%S")
+
+
+def _insert(db, rows):
+    """rows: (camera_id, label, direction, stored timestamp text)"""
+    for camera_id, label, direction, ts in rows:
+        db.execute(text(
+            "INSERT INTO alerts (camera_id, message, rule, direction, timestamp) "
+            "VALUES (:camera_id, :message, 'door', :direction, :ts)"
+        ), {"camera_id": camera_id, "message": f"Person {label}", "direction": direction, "ts": ts})
+    db.commit()
+
+
+def _ids(**kwargs):
+    return [row[0] for rows in exports.iter_alert_chunks(**kwargs) for row in rows]
+
+
+def _csv_rows(parts):
+    return list(csv.reader(io.StringIO(b"".join(parts).decode("utf-8"))))
+
+
+def test_export_carries_direction(db):
+    _insert(db, [
+        (1, "CHECKIN", "IN", _db_time(BASE)),
+        (1, "CHECKOUT", "OUT", _db_time(BASE + 1)),
+        (2, "lobby", None, _db_time(BASE + 2)),
+    ])
+    header, *rows = _csv_rows(exports.csv_stream(exports.iter_alert_chunks()))
+    assert header == exports.COLUMNS
+    direction = header.index("direction")
+    assert [r[direction] for r in rows] == ["IN", "OUT", ""]
+
+
+def test_parquet_export_carries_direction(db):
+    pq = pytest.importorskip("pyarrow.parquet")
+    _insert(db, [(1, "CHECKIN", "IN", _db_time(BASE)), (2, "lobby", None, _db_time(BASE + 1))])
+    data = b"".join(exports.parquet_stream(exports.iter_alert_chunks(chunk_size=1)))
+    table = pq.read_table(io.BytesIO(data))
+    assert table.column_names == exports.COLUMNS
+    assert table.column("direction").to_pylist() == ["IN", None]
+
+
+def test_resume_returns_exactly_the_missing_rows(db):
+    _insert(db, [(1, "IN", "IN", _db_time(BASE + i)) for i in range(10)])
+    until_id = exports.max_alert_id()
+    all_ids = _ids(until_id=until_id, chunk_size=3)
+    assert len(all_ids) == 10
+
+    # Rows added after the export started stay out of it, resumed or not
+    _insert(db, [(1, "OUT", "OUT", _db_time(BASE + 20))])
+    received = all_ids[:4]
+    rest = _ids(after_id=received[-1], until_id=until_id, chunk_size=3)
+    assert received + rest == all_ids
+
+    # The resumed request leaves out the header, so the parts concatenate into one file
+    first = exports.csv_stream(exports.iter_alert_chunks(until_id=received[-1]), header=True)
+    resumed = exports.csv_stream(exports.iter_alert_chunks(after_id=received[-1], until_id=until_id), header=False)
+    whole = exports.csv_stream(exports.iter_alert_chunks(until_id=until_id), header=True)
+    assert b"".join(first) + b"".join(resumed) == b"".join(whole)
+    assert _csv_rows(exports.csv_stream(iter([]), header=False)) == []
+
+
+@pytest.mark.parametrize("fraction", [True, False])
+def test_time_bounds_with_and_without_fractional_seconds(db, fraction):
+    _insert(db, [
+        (1, "IN", "IN", _db_time(BASE - 1, fraction)),
+        (1, "IN", "IN", _db_time(BASE, fraction)),        # == start: included
+        (1, "IN", "IN", _db_time(BASE + 0.5)),
+        (1, "IN", "IN", _db_time(BASE + 9, fraction)),
+        (1, "IN", "IN", _db_time(BASE + 10, fraction)),   # == end: excluded
+    ])
+    ids = _ids(start=BASE * 1000, end=(BASE + 10) * 1000)
+    assert len(ids) == 3
+
+    # Sub-second bounds
+    ids = _ids(start=BASE * 1000 + 250, end=(BASE + 9) * 1000 + 1)
+    assert len(ids) == 2
+
+
+def test_camera_filter_and_gzip(db):
+    _insert(db, [(1, "IN", "IN", _db_time(BASE)), (2, "IN", "IN", _db_time(BASE)), (2, "OUT", "OUT", _db_time(BASE))])
+    assert len(_ids(camera_ids=[2])) == 2
+    body = b"".join(exports.gzip_stream(exports.csv_stream(exports.iter_alert_chunks(camera_ids=[1]))))
+    rows = list(csv.reader(io.StringIO(gzip.decompress(body).decode("utf-8"))))
+    assert len(rows) == 2
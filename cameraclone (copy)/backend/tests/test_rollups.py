@@ -0,0 +1,143 @@
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import text
+
+import rollups
+from database import Base, SessionLocal, engine
+from models import Alert, AlertRollup, Camera
+
+DAY = 86400
+
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    session.query(AlertRollup).delete()
+    session.query(Alert).delete()
+    session.query(Camera).delete()
+    session.add_all([Camera(id=1, name="cam1", url="a.mp4"), Camera(id=2, name="cam2", url="b.mp4")])
+    session.commit()
+    yield session
+    session.close()
+
+
+def _ts(epoch):
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).replace(tzinfo=None)
+
+
+def _add(db, camera_id, direction, epoch, message=None, rule="door"):
+    """Alert saved the way main.save_alert does: row plus incremental rollup."""
+    ts = _ts(epoch)
+    db.add(Alert(camera_id=camera_id, message=message or f"Person {direction}", rule=rule,
+                 direction=direction, timestamp=ts))
+    rollups.record_alert(db, camera_id, direction, ts)
+    db.commit()
+
+
+def _rollup_rows(db):
+    return sorted(
+        (r.camera_id, r.granularity, r.bucket_start, r.direction, r.count)
+        for r in db.query(AlertRollup).all()
+    )
+
+
+def test_incremental_matches_rebuild(db):
+    base = 1700000000  # not aligned to a minute, hour or day
+    events = [
+        (1, "IN", base + 0.25),
+        (1, "IN", base + 59.999),
+        (1, "OUT", base + 61.5),
+        (2, "IN", base + 3600),
+        (2, "OUT", base + 3600 + 0.75),
+        (1, "OUT", base + DAY + 12.125),
+    ]
+    for camera_id, direction, epoch in events:
+        _add(db, camera_id, direction, epoch)
+    # Non-directional rule alerts never reach the rollups
+    _add(db, 1, None, base + 5, message="Person lobby", rule="lobby")
+    incremental = _rollup_rows(db)
+
+    rollups.rebuild_rollups(db)
+    assert _rollup_rows(db) == incremental
+    assert sum(r[4] for r in incremental if r[1] == "minute") == len(events)
+
+
+def test_rebuild_counts_whole_second_timestamps(db):
+    # Rows written by SQLite's CURRENT_TIMESTAMP carry no fractional seconds
+    base = 1700000000
+    db.execute(text(
+        "INSERT INTO alerts (camera_id, message, rule, direction, timestamp) "
+        "VALUES (1, 'Person IN', 'door', 'IN', :ts)"
+    ), {"ts": _ts(base).strftime("%Y-%m-%d %H:%M:%S")})
+    rollups.record_alert(db, 1, "IN", _ts(base))
+    db.commit()
+    incremental = _rollup_rows(db)
+
+    rollups.rebuild_rollups(db)
+    assert _rollup_rows(db) == incremental
+
+
+def test_buckets_align_to_epoch(db):
+    epoch = 1700000000 + 0.5
+    _add(db, 1, "IN", epoch)
+    starts = {r[1]: r[2] for r in _rollup_rows(db)}
+    assert starts == {
+        "minute": 1700000000 - 1700000000 % 60,
+        "hour": 1700000000 - 1700000000 % 3600,
+        "day": 1700000000 - 1700000000 % DAY,
+    }
+
+
+def test_rebuild_backfills_legacy_directions(db):
+    base = 1700000000
+    for message in ("Person IN", "Person IN", "Person OUT"):
+        db.add(Alert(camera_id=1, message=message, timestamp=_ts(base)))
+    # Rule alerts keep their NULL direction even if the label reads like one
+    db.add(Alert(camera_id=1, message="Person IN", rule="lobby", timestamp=_ts(base)))
+    db.commit()
+
+    rollups.rebuild_rollups(db)
+    counts = {r[3]: r[4] for r in _rollup_rows(db) if r[1] == "minute"}
+    assert counts == {"IN": 2, "OUT": 1}
+
+
+def test_occupancy_series_baseline_and_buckets(db):
+    day_start = 1700000000 - 1700000000 % DAY
+    # Before the range: a whole earlier day and part of the range's own day
+    _add(db, 1, "IN", day_start - DAY + 100)
+    _add(db, 1, "IN", day_start - DAY + 200.5)
+    _add(db, 1, "OUT", day_start + 30)
+    _add(db, 1, "IN", day_start + 600.25)
+    # Inside the range (starts one hour into the day, 15-minute buckets)
+    range_start = day_start + 3600
+    _add(db, 1, "IN", range_start + 10.5)
+    _add(db, 1, "IN", range_start + 899.9)
+    _add(db, 1, "OUT", range_start + 900)
+    _add(db, 2, "IN", range_start + 2000)
+
+    bucket_ms = 15 * 60 * 1000
+    result = rollups.occupancy_series(db, range_start * 1000, (range_start + 3600) * 1000, bucket_ms)
+    assert result["granularity"] == "minute"
+    assert result["start"] == range_start * 1000
+
+    cameras = {c["camera_id"]: c for c in result["cameras"]}
+    assert cameras[1]["baseline"] == 2
+    assert [(b["in"], b["out"], b["occupancy"]) for b in cameras[1]["series"]] == [
+        (2, 0, 4), (0, 1, 3), (0, 0, 3), (0, 0, 3),
+    ]
+    assert cameras[2]["baseline"] == 0
+    assert [b["occupancy"] for b in cameras[2]["series"]] == [0, 0, 1, 1]
+
+    only_two = rollups.occupancy_series(db, range_start * 1000, (range_start + 3600) * 1000, bucket_ms, [2])
+    assert [c["camera_id"] for c in only_two["cameras"]] == [2]
+
+
+def test_occupancy_series_rejects_bad_ranges(db):
+    with pytest.raises(ValueError):
+        rollups.occupancy_series(db, 0, 60000, 30000)
+    with pytest.raises(ValueError):
+        rollups.occupancy_series(db, 60000, 0, 60000)
+    with pytest.raises(ValueError):
+        rollups.occupancy_series(db, 0, (rollups.MAX_BUCKETS + 1) * 60000, 60000)
@@ -0,0 +1,83 @@
+import pytest
+
+from rules import build_rules, check_geometry, load_rules, update_default_rule, validate_rules
+
+LINE = {"x1": 0.5, "y1": 0.0, "x2": 0.5, "y2": 1.0}
+
+
+@pytest.mark.parametrize("label", ["../../../etc/x", "a b", "", "x" * 33, 5])
+def test_rejects_unsafe_labels(label):
+    with pytest.raises(ValueError):
+        validate_rules([{"type": "line", "line": LINE, "in_label": label}])
+
+
+def test_rejects_pixel_coordinates():
+    with pytest.raises(ValueError):
+        validate_rules([{"type": "line", "line": dict(LINE, x1=100)}])
+    with pytest.raises(ValueError):
+        validate_rules([{"type": "zone", "polygon": [[0, 0], [640, 0], [640, 480]]}])
+
+
+@pytest.mark.parametrize("field, value", [
+    ("cooldown", None),
+    ("cooldown", [1]),
+    ("cooldown", "5"),
+    ("dwell_seconds", None),
+    ("dwell_seconds", [1]),
+    ("max_occupancy", [1]),
+    ("max_occupancy", {"n": 3}),
+])
+def test_rejects_non_numeric_settings(field, value):
+    rule = {"type": "dwell", "polygon": [[0, 0], [1, 0], [1, 1]], field: value}
+    with pytest.raises(ValueError):
+        validate_rules([rule])
+
+
+@pytest.mark.parametrize("config", [
+    {"rules": ["door"]},
+    {"rules": {"name": "door"}},
+    {"polygon": "0,0 1,1", "line": LINE},
+    {"rules": [{"type": "zone", "polygon": [[0, 0], [1, 0], ["a", 1]]}]},
+    {"rules": [{"type": "line", "line": [0, 0, 1, 1]}]},
+])
+def test_check_geometry_rejects_malformed_configs(config):
+    with pytest.raises(ValueError):
+        check_geometry(config)
+
+
+def test_custom_line_labels_keep_their_direction():
+    rule = build_rules(validate_rules([
+        {"name": "door", "type": "line", "line": LINE, "in_label": "CHECKIN", "out_label": "CHECKOUT"},
+    ]))[0]
+    assert rule.direction_of("CHECKIN") == "IN"
+    assert rule.direction_of("CHECKOUT") == "OUT"
+
+    zone = build_rules(validate_rules([{"type": "zone", "polygon": [[0, 0], [1, 0], [1, 1]]}]))[0]
+    assert zone.direction_of("ENTER") is None
+
+
+def test_legacy_shapes_are_clamped_to_the_frame():
+    spec = load_rules({
+        "polygon": [{"x": -0.01, "y": 0.0}, {"x": 1.02, "y": 0.0}, {"x": 1.0, "y": 1.0}],
+        "line": dict(LINE, y2=1.01),
+    })[0]
+    assert spec["name"] == "default"
+    assert spec["polygon"][0]["x"] == 0.0
+    assert spec["polygon"][1]["x"] == 1.0
+    assert spec["line"]["y2"] == 1.0
+
+
+def test_drawn_shapes_update_the_default_rule():
+    rules = validate_rules([
+        {"name": "default", "type": "line", "line": LINE},
+        {"name": "lobby", "type": "zone", "polygon": [[0, 0], [1, 0], [1, 1]]},
+    ])
+    updated = update_default_rule(rules, line={"x1": 0.0, "y1": 0.5, "x2": 1.01, "y2": 0.5})
+    assert [r["name"] for r in updated] == ["default", "lobby"]
+    assert updated[0]["line"] == {"x1": 0.0, "y1": 0.5, "x2": 1.0, "y2": 0.5}
+    assert updated[1] == rules[1]
+    assert rules[0]["line"] == LINE
+
+    assert update_default_rule(rules[1:], line=LINE) is None
+    with pytest.raises(ValueError):
+        update_default_rule(rules, polygon=[["a", 0], [1, 0], [1, 1]])
@@ -0,0 +1,252 @@
+import json
+import time
+
+import pytest
+
+from database import Base, SessionLocal, engine
+from models import CameraLease, ClusterNode
+from sharding import LeaseManager, rendezvous_owner
+
+
+@pytest.fixture(autouse=True)
+def clean_db():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    db.query(CameraLease).delete()
+    db.query(ClusterNode).delete()
+    db.commit()
+    db.close()
+
+
+def _manager(node_id, cameras, started, lease_seconds=30, engine_alive=None):
+    return LeaseManager(
+        list_cameras=lambda: {c: 0 for c in cameras},
+        start_engine=started.add,
+        stop_engine=started.discard,
+        engine_alive=engine_alive,
+        node_id=node_id,
+        lease_seconds=lease_seconds,
+        interval=3600,
+    )
+
+
+def test_rendezvous_owner_is_stable():
+    nodes = ["a", "b", "c"]
+    owners = {c: rendezvous_owner(c, nodes) for c in range(100)}
+    assert set(owners.values()) == set(nodes)
+    # Removing a node only moves that node's cameras
+    remaining = {c: rendezvous_owner(c, ["a", "b"]) for c in range(100)}
+    assert all(remaining[c] == owners[c] for c in owners if owners[c] != "c")
+
+
+def test_duplicate_live_node_id_refuses_to_start():
+    first = _manager("host-1", [1, 2], set()).start()
+    try:
+        with pytest.raises(RuntimeError):
+            _manager("host-1", [1, 2], set()).start()
+    finally:
+        first.stop()
+
+    # A clean stop frees the ID at once
+    _manager("host-1", [1, 2], set()).start().stop()
+
+
+def test_expired_node_id_can_be_taken_over():
+    stale = _manager("host-1", [1], set(), lease_seconds=0.2)
+    stale.tick()
+    time.sleep(0.3)
+
+    started = set()
+    fresh = _manager("host-1", [1], started, lease_seconds=0.2).start()
+    try:
+        fresh.tick()
+        assert started == {1}
+        # The paused original notices it lost the ID and stops its engines
+        stale.running[1] = 0
+        stale.tick()
+        assert stale.running == {}
+    finally:
+        fresh.stop()
+
+
+def test_cameras_are_split_between_nodes():
+    cameras = list(range(1, 21))
+    started_a, started_b = set(), set()
+    a = _manager("a", cameras, started_a).start()
+    b = _manager("b", cameras, started_b).start()
+    try:
+        for _ in range(2):
+            a.tick()
+            b.tick()
+        assert started_a | started_b == set(cameras)
+        assert not started_a & started_b
+        assert started_a == {c for c in cameras if rendezvous_owner(c, ["a", "b"]) == "a"}
+    finally:
+        a.stop()
+        b.stop()
+
+
+def _owners(cameras, nodes, node):
+    return {c for c in cameras if rendezvous_owner(c, nodes) == node}
+
+
+def _lease_holders():
+    db = SessionLocal()
+    try:
+        now = time.time()
+        return {l.camera_id: l.node_id for l in db.query(CameraLease).all() if l.expires_at >= now}
+    finally:
+        db.close()
+
+
+def test_cameras_move_to_a_node_that_joins_later():
+    cameras = list(range(1, 21))
+    started_a, started_b = set(), set()
+    a = _manager("a", cameras, started_a).start()
+    try:
+        a.tick()
+        assert started_a == set(cameras)
+
+        b = _manager("b", cameras, started_b).start()
+        try:
+            b.tick()
+            # a still holds every lease, so b cannot start anything yet
+            assert started_b == set()
+            a.tick()
+            b.tick()
+            assert started_b == _owners(cameras, ["a", "b"], "b")
+            assert started_a == _owners(cameras, ["a", "b"], "a")
+        finally:
+            b.stop()
+    finally:
+        a.stop()
+
+
+def test_cameras_fail_over_when_a_node_stops_heartbeating():
+    cameras = list(range(1, 21))
+    started_a, started_b = set(), set()
+    a = _manager("a", cameras, started_a, lease_seconds=0.3).start()
+    b = _manager("b", cameras, started_b, lease_seconds=0.3).start()
+    try:
+        a.tick()
+        b.tick()
+        assert started_a == _owners(cameras, ["a", "b"], "a")
+        assert started_b and not started_a & started_b
+
+        # b hangs: no stop(), no more heartbeats or lease renewals
+        time.sleep(0.4)
+        a.tick()
+        assert started_a == set(cameras)
+        assert _lease_holders() == {c: "a" for c in cameras}
+    finally:
+        a.stop()
+        b.stop()
+
+
+def test_slow_engine_keeps_its_lease_until_it_exits():
+    cameras = list(range(1, 21))
+    alive = set()
+    started_a, started_b = set(), set()
+
+    def stop_slowly(camera_id):
+        started_a.discard(camera_id)
+        alive.add(camera_id)  # thread still winding down
+
+    a = LeaseManager(
+        list_cameras=lambda: {c: 0 for c in cameras},
+        start_engine=started_a.add,
+        stop_engine=stop_slowly,
+        engine_alive=lambda camera_id: camera_id in alive,
+        node_id="a",
+        lease_seconds=30,
+        interval=3600,
+    ).start()
+    a.tick()
+    assert started_a == set(cameras)
+    b = _manager("b", cameras, started_b).start()
+    try:
+        moving = _owners(cameras, ["a", "b"], "b")
+        start = time.time()
+        a.tick()  # signals the engines for b's cameras without waiting on them
+        assert time.time() - start < 1.0
+        assert a.stopping == moving
+
+        # Still running on a: leases stay with a, b must not start them
+        a.tick()
+        b.tick()
+        assert started_b == set()
+        assert all(_lease_holders()[c] == "a" for c in moving)
+
+        alive.clear()
+        a.tick()
+        b.tick()
+        assert started_b == moving
+        assert a.stopping == set()
+    finally:
+        a.engine_alive = lambda camera_id: False  # engines exit at once on shutdown
+        a.stop()
+        b.stop()
+
+
+def test_config_change_restarts_only_after_the_old_engine_exits():
+    versions = {1: 0}
+    alive = set()
+    starts = []
+
+    a = LeaseManager(
+        list_cameras=lambda: dict(versions),
+        start_engine=starts.append,
+        stop_engine=alive.add,
+        engine_alive=lambda camera_id: camera_id in alive,
+        node_id="a",
+        lease_seconds=30,
+        interval=3600,
+    ).start()
+    try:
+        a.tick()
+        assert starts == [1]
+
+        versions[1] = 1
+        a.tick()
+        a.tick()
+        assert starts == [1]  # old engine still running
+        assert _lease_holders() == {1: "a"}
+
+        alive.clear()
+        a.tick()
+        assert starts == [1, 1]
+        assert a.running == {1: 1}
+    finally:
+        a.engine_alive = lambda camera_id: False  # engines exit at once on shutdown
+        a.stop()
+
+
+def test_engine_status_is_shared_through_the_lease():
+    started = set()
+    a = LeaseManager(
+        list_cameras=lambda: {1: 0},
+        start_engine=started.add,
+        stop_engine=started.discard,
+        engine_status=lambda camera_id: {"state": "connected"} if camera_id in started else None,
+        node_id="a",
+        lease_seconds=30,
+        interval=3600,
+    ).start()
+    try:
+        a.tick()
+        a.tick()
+        db = SessionLocal()
+        try:
+            lease = db.query(CameraLease).filter(CameraLease.camera_id == 1).one()
+            assert lease.node_id == "a"
+            assert json.loads(lease.status)["state"] == "connected"
+        finally:
+            db.close()
+    finally:
+        a.stop()
+
+    db = SessionLocal()
+    try:
+        assert db.query(CameraLease).filter(CameraLease.camera_id == 1).one().status is None
+    finally:
+        db.close()
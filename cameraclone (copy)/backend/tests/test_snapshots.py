@@ -0,0 +1,128 @@
+"""
+Substream detection with main-stream snapshots, using two local files: the
+"analysis" file is read the way the rule engine reads it (through a
+CaptureSupervisor) and the "main" file through a seekable SnapshotSource.
+"""
+
+import cv2
+import numpy as np
+import pytest
+
+from streams import CaptureSupervisor, SnapshotSource, map_box
+
+FRAMES = 30
+
+
+def _write_video(path, size, fps):
+    """Each frame's grey level encodes its timestamp: 6 levels per 100 ms."""
+    width, height = size
+    writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    assert writer.isOpened()
+    for i in range(int(FRAMES * fps / 10)):
+        t_ms = i * 1000.0 / fps
+        writer.write(np.full((height, width, 3), int(t_ms / 100 * 6), np.uint8))
+    writer.release()
+
+
+def _time_ms(frame):
+    return round(float(frame.mean()) / 6) * 100
+
+
+def test_map_box_scales_between_resolutions():
+    assert map_box([10, 20, 110, 60], (320, 180), (1280, 720)) == [40, 80, 440, 240]
+    assert map_box([40, 80, 440, 240], (1280, 720), (320, 180)) == [10, 20, 110, 60]
+
+
+@pytest.mark.parametrize("main_fps", [10, 20])
+def test_snapshots_follow_the_analysis_stream(tmp_path, main_fps):
+    analysis_path = tmp_path / "analysis.avi"
+    main_path = tmp_path / "main.avi"
+    _write_video(analysis_path, (320, 180), 10)
+    _write_video(main_path, (1280, 720), main_fps)
+
+    cap = CaptureSupervisor(str(analysis_path), name="analysis")
+    snapshots = SnapshotSource(str(main_path), name="main").start()
+    try:
+        assert snapshots.seekable
+        for _ in range(FRAMES):
+            ok, frame = cap.read()
+            assert ok
+            pos = cap.get(cv2.CAP_PROP_POS_MSEC)
+
+            box = [10, 20, 110, 60]
+            snapshot, mapped = snapshots.snapshot(frame, box, pos)
+
+            assert snapshot.shape[:2] == (720, 1280)
+            assert mapped == [40, 80, 440, 240]
+            # Same moment in both files
+            assert _time_ms(snapshot) == _time_ms(frame)
+        assert snapshots.resolution == (1280, 720)
+    finally:
+        cap.release()
+        snapshots.release()
+
+
+def test_snapshot_falls_back_to_the_analysis_frame(tmp_path):
+    snapshots = SnapshotSource(str(tmp_path / "missing.avi"), name="main").start()
+    try:
+        frame = np.zeros((180, 320, 3), np.uint8)
+        snapshot, box = snapshots.snapshot(frame, [1, 2, 3, 4], 0.0)
+        assert snapshot is frame
+        assert box == [1, 2, 3, 4]
+    finally:
+        snapshots.release()
+
+
+def _write_h264(path, frames, size=(640, 360), fps=10, gop=10):
+    """H.264 with B-frames; frame i has grey level 8 * i."""
+    av = pytest.importorskip("av")
+    if "libx264" not in av.codecs_available:
+        pytest.skip("libx264 encoder not available")
+    width, height = size
+    out = av.open(str(path), "w")
+    stream = out.add_stream("libx264", rate=fps, options={"g": str(gop), "keyint_min": str(gop), "bf": "2", "sc_threshold": "0"})
+    stream.width, stream.height, stream.pix_fmt = width, height, "yuv420p"
+    for i in range(frames):
+        frame = av.VideoFrame.from_ndarray(np.full((height, width, 3), 8 * i, np.uint8), format="bgr24")
+        for packet in stream.encode(frame):
+            out.mux(packet)
+    for packet in stream.encode():
+        out.mux(packet)
+    out.close()
+
+
+def test_packet_ring_decodes_only_on_retrieve(tmp_path, monkeypatch):
+    path = tmp_path / "main.mp4"
+    _write_h264(path, 30)
+    import av
+    from streams import PacketRing
+
+    decoders = []
+    create = av.CodecContext.create
+    monkeypatch.setattr(av.CodecContext, "create", lambda *a, **k: decoders.append(a) or create(*a, **k))
+
+    ring = PacketRing(str(path), timeout_seconds=5)
+    try:
+        assert ring.isOpened()
+        fps = 10
+        newest = -1
+        for _ in range(17):
+            assert ring.grab()
+            newest = max(newest, round(ring._gop[-1].pts * ring._gop[-1].time_base * fps))
+            # Only the packets since the last keyframe are held
+            assert 1 <= len(ring._gop) <= 10
+        assert decoders == []
+
+        ok, frame = ring.retrieve()
+        assert ok
+        assert frame.shape == (360, 640, 3)
+        assert round(float(frame.mean()) / 8) == newest
+        assert len(decoders) == 1
+    finally:
+        ring.release()
+    assert ring._gop == []
+
+
+def test_live_main_stream_is_not_seeked():
+    snapshots = SnapshotSource("rtsp://camera.invalid/main", name="main")
+    assert not snapshots.seekable
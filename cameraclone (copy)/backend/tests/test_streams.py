@@ -0,0 +1,153 @@
+"""
+CaptureSupervisor against a local video file wrapped (through `open_fn`) to
+disconnect or freeze on purpose.
+"""
+
+import threading
+import time
+
+import cv2
+import numpy as np
+import pytest
+
+from streams import CaptureSupervisor
+
+
+class FlakyCapture:
+    """
+    cv2.VideoCapture wrapper: every read after `fail_after` good ones fails
+    (a camera that accepts the connection and then drops), or, with
+    `freeze_after`, the stream keeps returning the same frame and timestamp.
+    """
+
+    def __init__(self, path, fail_after=None, freeze_after=None):
+        self.cap = cv2.VideoCapture(path)
+        self.fail_after = fail_after
+        self.freeze_after = freeze_after
+        self.reads = 0
+        self._frozen = None
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        self.reads += 1
+        if self.fail_after is not None and self.reads > self.fail_after:
+            return False, None
+        if self.freeze_after is not None and self.reads > self.freeze_after:
+            time.sleep(0.01)
+            return True, self._frozen
+        ok, frame = self.cap.read()
+        if not ok:
+            # Loop the file like a live stream
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.cap.read()
+        self._frozen = frame
+        return ok, frame
+
+    def grab(self):
+        return self.read()[0]
+
+    def get(self, prop):
+        if self.freeze_after is not None and self.reads > self.freeze_after:
+            return float(self.freeze_after * 100)
+        return self.cap.get(prop)
+
+    def release(self):
+        self.cap.release()
+
+
+@pytest.fixture(scope="module")
+def video(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("video") / "source.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (64, 48))
+    for i in range(20):
+        writer.write(np.full((48, 64, 3), i * 10, np.uint8))
+    writer.release()
+    return path
+
+
+def _read_for(supervisor, seconds):
+    frames = 0
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        ok, frame = supervisor.read()
+        assert ok and frame is not None
+        frames += 1
+    return frames
+
+
+def test_dropping_source_backs_off(video):
+    opened = []
+
+    def open_fn(url):
+        opened.append(time.time())
+        return FlakyCapture(url, fail_after=5)
+
+    supervisor = CaptureSupervisor(video, name="flaky", stall_timeout=1.0,
+                                   min_backoff=0.01, max_backoff=0.16, open_fn=open_fn)
+    try:
+        _read_for(supervisor, 1.5)
+    finally:
+        supervisor.release()
+
+    # Connections never stay up for stall_timeout, so backoff climbs to the max
+    assert supervisor._backoff == supervisor.max_backoff
+    assert supervisor.failures == supervisor.reconnects
+    # Without backoff growth this source reconnects hundreds of times a second
+    assert 5 <= len(opened) <= 40
+    assert supervisor.last_error == "read failed"
+
+
+def test_backoff_resets_after_a_healthy_connection(video):
+    connections = []
+
+    def open_fn(url):
+        # First two connections drop at once, the third stays healthy
+        connections.append(url)
+        return FlakyCapture(url, fail_after=0 if len(connections) <= 2 else None)
+
+    supervisor = CaptureSupervisor(video, name="recovering", stall_timeout=0.3,
+                                   min_backoff=0.01, max_backoff=1.0, open_fn=open_fn)
+    try:
+        supervisor.read()
+        assert supervisor._backoff == 0.04
+        _read_for(supervisor, 0.5)
+        assert supervisor._backoff == supervisor.min_backoff
+        assert supervisor.status()["state"] == "connected"
+    finally:
+        supervisor.release()
+
+
+def test_frozen_stream_is_reconnected(video):
+    opened = []
+
+    def open_fn(url):
+        opened.append(url)
+        return FlakyCapture(url, freeze_after=3 if len(opened) == 1 else None)
+
+    supervisor = CaptureSupervisor(video, name="frozen", stall_timeout=0.4,
+                                   min_backoff=0.01, max_backoff=0.05, open_fn=open_fn).start()
+    try:
+        _read_for(supervisor, 1.5)
+        status = supervisor.status()
+    finally:
+        supervisor.release()
+
+    assert len(opened) >= 2
+    assert status["reconnects"] >= 1
+    assert supervisor.last_error == "stream stalled"
+
+
+def test_read_returns_false_once_stopped(video):
+    stop = threading.Event()
+    supervisor = CaptureSupervisor(video, name="stopped", stop_event=stop,
+                                   open_fn=lambda url: FlakyCapture(url, fail_after=0),
+                                   min_backoff=5.0, max_backoff=5.0)
+    threading.Timer(0.2, stop.set).start()
+    started = time.time()
+    ok, frame = supervisor.read()
+    assert not ok and frame is None
+    # The backoff wait is interrupted by the stop event
+    assert time.time() - started < 2.0
+    assert supervisor.status()["state"] == "stopped"
@@ -0,0 +1,91 @@
+import tracemalloc
+
+from track_state import TrackStateStore
+
+FPS = 10
+DAY_FRAMES = 24 * 3600 * FPS  # 864k frames
+
+
+def _visible(frame):
+    """
+    Track IDs on screen at `frame`: a new person every 2 s, each visible for
+    10 s (about 5 at once), with every third person dropping out for a few
+    frames mid-way, like a tracker losing and re-finding them.
+    """
+    newest = frame // 20
+    ids = []
+    for track_id in range(max(0, newest - 4), newest + 1):
+        age = frame - track_id * 20
+        if track_id % 3 == 0 and 40 <= age < 45:
+            continue
+        ids.append(track_id)
+    return ids
+
+
+def _run(store, frames, start=0, on_hour=None):
+    for frame in range(start, start + frames):
+        now = frame / FPS
+        store.begin_frame(now=now)
+        ids = _visible(frame)
+        store.mark_seen(ids)
+        for track_id in ids:
+            # Cross a line half-way through the visit
+            side = -1 if frame - track_id * 20 < 50 else 1
+            state = store.get(track_id)
+            if state is None:
+                store.update(track_id, side)
+                continue
+            if state.side != side and not store.in_cooldown(state):
+                store.mark_alert(state)
+            state.side = side
+        if on_hour is not None and frame % (3600 * FPS) == 0:
+            on_hour(frame)
+
+
+def test_track_state_stays_bounded_over_a_day():
+    store = TrackStateStore(cooldown=3)
+    sizes = []
+
+    # Warm up for an hour so dict and free-list sizes settle before measuring
+    _run(store, 3600 * FPS)
+
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        _run(store, DAY_FRAMES - 3600 * FPS, start=3600 * FPS, on_hour=lambda f: sizes.append(len(store)))
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # ~43k distinct IDs over the day; only recently seen ones are kept
+    assert store.frame == DAY_FRAMES
+    assert len(sizes) == 23
+    assert max(sizes) <= 30
+    assert len(store) <= 30
+    assert peak - baseline < 64 * 1024
+    assert current - baseline < 16 * 1024
+
+
+def test_evicts_missing_tracks_after_cooldown():
+    store = TrackStateStore(cooldown=3, max_missing_frames=5, ttl_seconds=60, sweep_interval=1)
+    store.begin_frame(now=0.0)
+    state = store.update(1, 1)
+    store.mark_alert(state)
+
+    # Missing for more than max_missing_frames, but the cooldown is still running
+    for i in range(1, 11):
+        store.begin_frame(now=i * 0.1)
+    assert 1 in store
+
+    store.begin_frame(now=3.5)
+    assert 1 not in store
+
+
+def test_ttl_evicts_tracks_seen_in_sparse_frames():
+    store = TrackStateStore(cooldown=0, max_missing_frames=1000, ttl_seconds=10, sweep_interval=1)
+    store.begin_frame(now=0.0)
+    store.update(7, -1)
+    store.begin_frame(now=5.0)
+    assert 7 in store
+    store.begin_frame(now=11.0)
+    assert 7 not in store
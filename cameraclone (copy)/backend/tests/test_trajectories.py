@@ -0,0 +1,66 @@
+import os
+import time
+
+import numpy as np
+
+import trajectories
+from trajectories import TrajectoryRecorder, load_trajectories, replay
+
+WIDTH, HEIGHT = 640, 480
+CONFIG = {
+    "rules": [
+        {"name": "door", "type": "line", "line": {"x1": 0.5, "y1": 0.0, "x2": 0.5, "y2": 1.0}},
+        {"name": "lobby", "type": "zone", "polygon": [[0.5, 0.0], [1.0, 0.0], [1.0, 1.0], [0.5, 1.0]]},
+    ]
+}
+
+
+def _walk(recorder, t0, track_id, xs):
+    """One track moving through normalized x positions, one frame per 100 ms."""
+    for i, x in enumerate(xs):
+        cx, cy = x * WIDTH, HEIGHT / 2
+        box = np.array([[cx - 20, cy - 40, cx + 20, cy + 40]])
+        recorder.add(t0 + i * 0.1, [track_id], box, WIDTH, HEIGHT)
+
+
+def _counts(result):
+    return {r["name"]: r["counts"] for r in result["rules"]}
+
+
+def test_restarted_track_ids_do_not_join(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    t0 = time.time()
+
+    # Track 1 waits on the left, the engine restarts, and a different
+    # person gets track 1 on the right
+    first = TrajectoryRecorder(1)
+    _walk(first, t0, 1, [0.2] * 10)
+    first.close()
+    second = TrajectoryRecorder(1)
+    assert second.session != first.session
+    _walk(second, t0 + 2, 1, [0.8] * 10)
+    # A real crossing after a tracker reset in the same engine
+    second.new_session()
+    _walk(second, t0 + 4, 1, [0.2] * 5 + [0.8] * 5)
+    second.close()
+
+    data = load_trajectories(1, t0 - 1, t0 + 10)
+    assert len(data) == 30
+    result = replay(1, CONFIG, t0 - 1, t0 + 10)
+    assert result["tracks"] == 3
+    assert _counts(result) == {
+        "door": {"IN": 0, "OUT": 1},
+        "lobby": {"ENTER": 1, "EXIT": 0},
+    }
+
+
+def test_prune_removes_expired_hours(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cam_dir = os.path.join(trajectories.TRAJECTORY_DIR, "camera_3")
+    os.makedirs(cam_dir)
+    now = 1_700_000_000  # 2023-11-14 22:13 UTC
+    for name in ["2023111118.tracks", "2023111122.tracks", "2023111420.tracks", "notes.txt"]:
+        open(os.path.join(cam_dir, name), "wb").close()
+
+    assert trajectories.prune(max_age_hours=72, now=now) == 1
+    assert sorted(os.listdir(cam_dir)) == ["2023111122.tracks", "2023111420.tracks", "notes.txt"]
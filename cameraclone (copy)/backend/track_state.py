@@ -0,0 +1,101 @@
+"""
+Bounded per-camera tracking state.
+
+Each rule engine owns one TrackStateStore. Entries are updated in place and
+evicted once a track has been missing for too many frames or too long, so
+memory stays flat no matter how many track IDs the tracker hands out.
+"""
+
+import time
+
+
+class TrackState:
+    __slots__ = ("side", "last_seen_frame", "last_seen_time", "last_alert", "since")
+
+    def __init__(self, side, frame, now):
+        self.side = side
+        self.last_seen_frame = frame
+        self.last_seen_time = now
+        self.last_alert = None
+        self.since = now
+
+
+class TrackStateStore:
+    """
+    Side / last-seen / cooldown per track ID for one camera.
+
+    A track is evicted when it has not been seen for more than
+    `max_missing_frames` frames (unless its alert cooldown is still running)
+    or for more than `ttl_seconds`, whichever comes first.
+    """
+
+    def __init__(self, cooldown=3.0, max_missing_frames=30, ttl_seconds=60.0, sweep_interval=30):
+        self.cooldown = cooldown
+        self.max_missing_frames = max_missing_frames
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval = sweep_interval
+        self.frame = 0
+        self.now = 0.0
+        self._tracks = {}
+
+    def __len__(self):
+        return len(self._tracks)
+
+    def __contains__(self, track_id):
+        return track_id in self._tracks
+
+    def begin_frame(self, now=None):
+        """Advance the frame clock; sweeps stale tracks every `sweep_interval` frames."""
+        self.frame += 1
+        self.now = time.time() if now is None else now
+        if self.frame % self.sweep_interval == 0:
+            self.evict()
+
+    def get(self, track_id):
+        return self._tracks.get(track_id)
+
+    def mark_seen(self, track_ids):
+        """Refresh last-seen for every track the tracker reported this frame."""
+        frame = self.frame
+        now = self.now
+        tracks = self._tracks
+        for track_id in track_ids:
+            state = tracks.get(track_id)
+            if state is not None:
+                state.last_seen_frame = frame
+                state.last_seen_time = now
+
+    def update(self, track_id, side):
+        """Set the side for a track, creating its entry if needed. Returns the state."""
+        state = self._tracks.get(track_id)
+        if state is None:
+            state = TrackState(side, self.frame, self.now)
+            self._tracks[track_id] = state
+        else:
+            state.side = side
+            state.last_seen_frame = self.frame
+            state.last_seen_time = self.now
+        return state
+
+    def in_cooldown(self, state):
+        return state.last_alert is not None and self.now - state.last_alert <= self.cooldown
+
+    def mark_alert(self, state):
+        state.last_alert = self.now
+
+    def evict(self):
+        """Drop stale tracks. Returns how many were removed."""
+        frame = self.frame
+        now = self.now
+        stale = [
+            track_id
+            for track_id, state in self._tracks.items()
+            if now - state.last_seen_time > self.ttl_seconds
+            or (frame - state.last_seen_frame > self.max_missing_frames and not self.in_cooldown(state))
+        ]
+        for track_id in stale:
+            del self._tracks[track_id]
+        return len(stale)
+
+    def clear(self):
+        self._tracks.clear()
@@ -0,0 +1,345 @@
+"""
+Recorded track trajectories and rule replay.
+
+With "record_trajectories": true in a camera config, the rule engine appends
+one fixed-size record per tracked box per frame to hourly files under
+data/trajectories/camera_<id>/ (UTC hours, raw numpy records, append-only).
+Files older than TRAJECTORY_MAX_AGE_HOURS (env, default 72) are deleted.
+
+Tracker IDs start again when an engine restarts or resets its tracker, so
+every record carries the recording session and a track is identified by
+(session, track_id).
+
+`replay()` re-evaluates any candidate rule config over a time range with
+numpy instead of re-running detection, and returns the counts it would have
+produced. Replay follows the live engine's crossing, zone and dwell logic
+but not its track eviction, so counts can differ slightly for tracks that
+vanish and reappear under the same ID.
+"""
+
+import os
+import random
+import re
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from rules import LINE_THRESHOLD, load_rules, oriented_line
+
+TRAJECTORY_DIR = os.path.join("data", "trajectories")
+TRAJECTORY_EXT = ".tracks"
+TRAJECTORY_MAX_AGE_HOURS = float(os.environ.get("TRAJECTORY_MAX_AGE_HOURS", 72))
+
+# 36 bytes per record; positions and sizes are normalized to the frame
+RECORD_DTYPE = np.dtype([
+    ("t", "<f8"),
+    ("session", "<u4"),
+    ("track_id", "<i4"),
+    ("cx", "<f4"),
+    ("cy", "<f4"),
+    ("w", "<f4"),
+    ("h", "<f4"),
+    ("frame_w", "<u2"),
+    ("frame_h", "<u2"),
+])
+
+
+def _camera_dir(camera_id):
+    return os.path.join(TRAJECTORY_DIR, f"camera_{camera_id}")
+
+
+def _hour_key(ts):
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y%m%d%H")
+
+
+_HOUR_FILE = re.compile(r"^(\d{10})\.")
+
+
+def prune(camera_id=None, max_age_hours=TRAJECTORY_MAX_AGE_HOURS, now=None):
+    """
+    Delete hourly files that ended more than `max_age_hours` ago, for one
+    camera or all of them. Returns the number of files removed.
+    """
+    now = time.time() if now is None else now
+    cutoff = _hour_key(now - max_age_hours * 3600)
+    if camera_id is not None:
+        dirs = [_camera_dir(camera_id)]
+    elif os.path.isdir(TRAJECTORY_DIR):
+        dirs = [os.path.join(TRAJECTORY_DIR, d) for d in os.listdir(TRAJECTORY_DIR)]
+    else:
+        dirs = []
+
+    removed = 0
+    for cam_dir in dirs:
+        if not os.path.isdir(cam_dir):
+            continue
+        for filename in os.listdir(cam_dir):
+            match = _HOUR_FILE.match(filename)
+            # An hour file is kept while any of its hour is within the window
+            if match and match.group(1) < cutoff:
+                try:
+                    os.remove(os.path.join(cam_dir, filename))
+                    removed += 1
+                except OSError as e:
+                    print(f"Failed to prune trajectory file {filename}: {e}")
+    return removed
+
+
+class TrajectoryRecorder:
+    """
+    Buffers records in a preallocated array and appends them to the hourly
+    file. Call new_session() whenever the tracker's IDs start again.
+    """
+
+    def __init__(self, camera_id, capacity=4096, flush_seconds=5.0, max_age_hours=TRAJECTORY_MAX_AGE_HOURS):
+        self.camera_id = camera_id
+        self.flush_seconds = flush_seconds
+        self.max_age_hours = max_age_hours
+        self.session = None
+        self.new_session()
+        self._buf = np.zeros(capacity, RECORD_DTYPE)
+        self._n = 0
+        self._last_flush = time.time()
+        self._last_hour = None
+        os.makedirs(_camera_dir(camera_id), exist_ok=True)
+
+    def new_session(self):
+        # Random, so engines restarted within the same second still differ
+        previous = self.session
+        while self.session == previous:
+            self.session = random.getrandbits(32)
+
+    def add(self, t, track_ids, boxes, width, height):
+        """Record one frame: `boxes` is an (N, 4) xyxy pixel array matching `track_ids`."""
+        n = len(track_ids)
+        if n == 0:
+            return
+        if self._n + n > len(self._buf) or _hour_key(t) != self._buffer_hour():
+            self.flush()
+        if n > len(self._buf):
+            self._buf = np.zeros(n, RECORD_DTYPE)
+
+        boxes = np.asarray(boxes, dtype=np.float32)
+        # Same integer box centre the rule engine evaluates
+        ibox = np.trunc(boxes).astype(np.int64)
+        rows = self._buf[self._n:self._n + n]
+        rows["t"] = t
+        rows["session"] = self.session
+        rows["track_id"] = track_ids
+        rows["cx"] = ((ibox[:, 0] + ibox[:, 2]) // 2) / float(width)
+        rows["cy"] = ((ibox[:, 1] + ibox[:, 3]) // 2) / float(height)
+        rows["w"] = (boxes[:, 2] - boxes[:, 0]) / width
+        rows["h"] = (boxes[:, 3] - boxes[:, 1]) / height
+        rows["frame_w"] = width
+        rows["frame_h"] = height
+        self._n += n
+
+        if t - self._last_flush >= self.flush_seconds:
+            self.flush()
+
+    def _buffer_hour(self):
+        return _hour_key(self._buf["t"][0]) if self._n else None
+
+    def flush(self):
+        self._last_flush = time.time()
+        if not self._n:
+            return
+        hour = self._buffer_hour()
+        if hour != self._last_hour:
+            # Once per new hourly file (and at the first flush)
+            self._last_hour = hour
+            prune(self.camera_id, self.max_age_hours)
+        path = os.path.join(_camera_dir(self.camera_id), f"{hour}{TRAJECTORY_EXT}")
+        try:
+            with open(path, "ab") as f:
+                f.write(self._buf[:self._n].tobytes())
+        except Exception as e:
+            print(f"Camera {self.camera_id}: failed to write trajectories: {e}")
+        self._n = 0
+
+    def close(self):
+        self.flush()
+
+
+def load_trajectories(camera_id, start, end):
+    """Records with start <= t < end (epoch seconds), sorted by (session, track) then time."""
+    cam_dir = _camera_dir(camera_id)
+    if not os.path.isdir(cam_dir):
+        return np.zeros(0, RECORD_DTYPE)
+
+    first_hour = _hour_key(start)
+    last_hour = _hour_key(end)
+    parts = []
+    for filename in sorted(os.listdir(cam_dir)):
+        hour, ext = os.path.splitext(filename)
+        if ext != TRAJECTORY_EXT or hour < first_hour or hour > last_hour:
+            continue
+        # A partially written trailing record is ignored
+        path = os.path.join(cam_dir, filename)
+        count = os.path.getsize(path) // RECORD_DTYPE.itemsize
+        data = np.fromfile(path, dtype=RECORD_DTYPE, count=count)
+        parts.append(data[(data["t"] >= start) & (data["t"] < end)])
+
+    if not parts:
+        return np.zeros(0, RECORD_DTYPE)
+    data = np.concatenate(parts)
+    return data[np.lexsort((data["t"], data["track_id"], data["session"]))]
+
+
+def track_keys(data):
+    """One int64 per record identifying its track: (session, track_id) packed."""
+    return (data["session"].astype(np.int64) << 32) | (data["track_id"].astype(np.int64) & 0xFFFFFFFF)
+
+
+def points_in_polygon(px, py, polygon):
+    """
+    Vectorized even-odd test; `polygon` is a (K, 2) array in the same units.
+    Points on an edge count as inside, like cv2.pointPolygonTest(...) >= 0.
+    """
+    inside = np.zeros(len(px), dtype=bool)
+    on_edge = np.zeros(len(px), dtype=bool)
+    xs = polygon[:, 0].astype(np.float64)
+    ys = polygon[:, 1].astype(np.float64)
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        xi, yi, xj, yj = xs[i], ys[i], xs[j], ys[j]
+        crosses = (yi > py) != (yj > py)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_at = (xj - xi) * (py - yi) / (yj - yi) + xi
+        inside ^= crosses & (px < x_at)
+        on_edge |= (
+            ((xj - xi) * (py - yi) - (yj - yi) * (px - xi) == 0) &
+            (px >= min(xi, xj)) & (px <= max(xi, xj)) &
+            (py >= min(yi, yj)) & (py <= max(yi, yj))
+        )
+        j = i
+    return inside | on_edge
+
+
+def _pixel_geometry(data, spec):
+    """Per-record pixel position, ROI membership and (for lines) side distance."""
+    px = np.rint(data["cx"].astype(np.float64) * data["frame_w"])
+    py = np.rint(data["cy"].astype(np.float64) * data["frame_h"])
+    inside = np.ones(len(data), dtype=bool)
+    side = np.zeros(len(data))
+
+    # Geometry is denormalized per recorded resolution, like the live engine
+    resolutions = np.unique(np.stack([data["frame_w"], data["frame_h"]], axis=1), axis=0)
+    for width, height in resolutions:
+        mask = (data["frame_w"] == width) & (data["frame_h"] == height)
+        if spec.get("polygon"):
+            polygon = np.array([[int(p["x"] * width), int(p["y"] * height)] for p in spec["polygon"]], np.float64)
+            inside[mask] = points_in_polygon(px[mask], py[mask], polygon)
+        if spec["type"] == "line":
+            lx1, ly1, lx2, ly2 = oriented_line(spec["line"], int(width), int(height))
+            line_len = np.sqrt((lx2 - lx1)**2 + (ly2 - ly1)**2) + 1e-6
+            side[mask] = ((lx2 - lx1) * (py[mask] - ly1) - (ly2 - ly1) * (px[mask] - lx1)) / line_len
+    return inside, side
+
+
+def _apply_cooldown(track_ids, times, cooldown):
+    """Keep events that are more than `cooldown` seconds after the track's last kept event."""
+    keep = np.zeros(len(times), dtype=bool)
+    last = {}
+    for i, (track_id, t) in enumerate(zip(track_ids.tolist(), times.tolist())):
+        prev = last.get(track_id)
+        if prev is None or t - prev > cooldown:
+            keep[i] = True
+            last[track_id] = t
+    return keep
+
+
+def _replay_line(data, spec):
+    inside, side = _pixel_geometry(data, spec)
+    # The live engine only updates a track's side while it is inside the ROI
+    data, side = data[inside], side[inside]
+    if len(data) < 2:
+        return {spec["in_label"]: 0, spec["out_label"]: 0}
+
+    keys = track_keys(data)
+    same_track = keys[1:] == keys[:-1]
+    prev, cur = side[:-1], side[1:]
+    crossing = (
+        same_track &
+        (np.abs(prev) > LINE_THRESHOLD) &
+        (np.abs(cur) > LINE_THRESHOLD) &
+        (prev * cur < 0)
+    )
+    idx = np.nonzero(crossing)[0] + 1
+    idx = idx[_apply_cooldown(keys[idx], data["t"][idx], spec["cooldown"])]
+    positive = int(np.count_nonzero(side[idx] > 0))
+    return {spec["in_label"]: positive, spec["out_label"]: len(idx) - positive}
+
+
+def _replay_zone(data, spec):
+    inside, _ = _pixel_geometry(data, spec)
+    if len(data) < 2:
+        return {spec["in_label"]: 0, spec["out_label"]: 0}
+
+    keys = track_keys(data)
+    same_track = keys[1:] == keys[:-1]
+    change = same_track & (inside[1:] != inside[:-1])
+    idx = np.nonzero(change)[0] + 1
+    idx = idx[_apply_cooldown(keys[idx], data["t"][idx], spec["cooldown"])]
+    entered = int(np.count_nonzero(inside[idx]))
+    return {spec["in_label"]: entered, spec["out_label"]: len(idx) - entered}
+
+
+def _replay_dwell(data, spec):
+    inside, _ = _pixel_geometry(data, spec)
+    counts = {spec["label"]: 0}
+    if spec.get("max_occupancy") is not None:
+        counts[spec["occupancy_label"]] = 0
+    if not inside.any():
+        return counts
+
+    # A visit starts on a track's first inside record after being outside (or new)
+    prev_inside = np.concatenate([[False], inside[:-1]])
+    keys = track_keys(data)
+    new_track = np.concatenate([[True], keys[1:] != keys[:-1]])
+    visit_start = inside & (new_track | ~prev_inside)
+    visit_id = np.cumsum(visit_start)[inside] - 1
+    t_inside = data["t"][inside]
+
+    n_visits = int(visit_id[-1]) + 1
+    first = np.full(n_visits, np.inf)
+    last = np.full(n_visits, -np.inf)
+    np.minimum.at(first, visit_id, t_inside)
+    np.maximum.at(last, visit_id, t_inside)
+    counts[spec["label"]] = int(np.count_nonzero(last - first >= spec["dwell_seconds"]))
+
+    if spec.get("max_occupancy") is not None:
+        frame_times, occupancy = np.unique(t_inside, return_counts=True)
+        over = frame_times[occupancy > spec["max_occupancy"]]
+        keep = _apply_cooldown(np.zeros(len(over), dtype=np.int64), over, spec["cooldown"])
+        counts[spec["occupancy_label"]] = int(np.count_nonzero(keep))
+    return counts
+
+
+REPLAYERS = {
+    "line": _replay_line,
+    "zone": _replay_zone,
+    "dwell": _replay_dwell,
+}
+
+
+def replay(camera_id, config, start, end):
+    """
+    Counts each rule in `config` would have produced between `start` and `end`
+    (epoch seconds). Raises ValueError for an invalid config.
+    """
+    specs = load_rules(config)
+    if not specs:
+        raise ValueError("Config needs polygon and line, or a rules list")
+
+    data = load_trajectories(camera_id, start, end)
+    return {
+        "camera_id": camera_id,
+        "points": int(len(data)),
+        "tracks": int(len(np.unique(track_keys(data)))),
+        "rules": [
+            {"name": spec["name"], "type": spec["type"], "counts": REPLAYERS[spec["type"]](data, spec)}
+            for spec in specs
+        ],
+    }
@@ -452,7 +452,9 @@ function saveRule() {
     }
 
     if (promise) {
-        promise.then(res => res.json()).then(() => {
+        promise.then(res => res.json().then(data => {
+            if (!res.ok) throw new Error(data.detail || "Save failed");
+        })).then(() => {
             // Auto-deploy to apply changes immediately
             fetch(`${API}/camera/${currentCameraId}/deploy`, { method: "POST" })
                 .then(res => res.json())
@@ -464,7 +466,7 @@ function saveRule() {
                     console.error(err);
                     alert("Rules saved but deploy failed.");
                 });
-        });
+        }).catch(err => alert(`Could not save: ${err.message}`));
     }
 }
 
@@ -590,6 +592,10 @@ function loadAlerts() {
                                 <div class="absolute inset-x-0 bottom-0 bg-gradient-to-t from-black/90 to-transparent p-2">
                                     <div class="flex items-center justify-between">
                                         <span class="text-[9px] font-mono text-gray-400">${timeStr}</span>
+                                        ${a.clip
+                                            ? `<a href="${API}/${a.clip}" target="_blank" class="relative z-10 text-gray-300 hover:text-white"><i class="ph-bold ph-film-strip text-xs"></i></a>`
+                                            : ''
+                                        }
                                         <span class="w-2 h-2 rounded-full ${badgeClass}"></span>
                                     </div>
                                 </div>